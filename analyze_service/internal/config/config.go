@@ -20,6 +20,7 @@ type (
 		MigrationPath   string            `yaml:"migration_path" env-required:"true"`
 		MoralisAPIKey   string            `env:"MORALIS_API_KEY"`
 		MLServiceAdress string            `yaml:"ml_service_address" env-required:"true"`
+		MLWireFormat    string            `yaml:"ml_wire_format" env:"ML_WIRE_FORMAT" env-default:"rows"`
 		HTTPServer      `yaml:"http_server"`
 		CORS            `yaml:"cors"`
 	}
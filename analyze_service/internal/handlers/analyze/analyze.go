@@ -47,6 +47,19 @@ type (
 		To        string  `json:"to"`
 	}
 
+	// MLColumnarRequest is a compact request format: parallel arrays instead of an object per transaction
+	MLColumnarRequest struct {
+		Address string          `json:"address"`
+		Columns MLColumnarBatch `json:"columns"`
+	}
+
+	MLColumnarBatch struct {
+		Timestamp []int64   `json:"timestamp"`
+		Value     []float64 `json:"value"`
+		Method    []string  `json:"method"`
+		To        []string  `json:"to"`
+	}
+
 	Repository interface {
 		GetTransactions(address string) (*moralis.MoralisResponse, error)
 	}
@@ -54,6 +67,9 @@ type (
 
 const (
 	ethAddressRegex = "^0x[0-9a-fA-F]{40}$"
+
+	MLWireFormatRows     = "rows"
+	MLWireFormatColumnar = "columnar"
 )
 
 // Analyze handles Ethereum address analysis.
@@ -115,7 +131,12 @@ func Analyze(log *slog.Logger, repo Repository, c *config.Config) http.HandlerFu
 			slog.Int("native_transfers", len(nativeTransfers)))
 
 		// Prepare data for ML service
-		mlRequest := prepareMLRequest(req.Address, moralisResp.Result)
+		var mlRequest interface{}
+		if c.MLWireFormat == MLWireFormatColumnar {
+			mlRequest = prepareMLColumnarRequest(req.Address, moralisResp.Result)
+		} else {
+			mlRequest = prepareMLRequest(req.Address, moralisResp.Result)
+		}
 		mlResult, err := sendToMLService(c.MLServiceAdress, mlRequest)
 		if err != nil {
 			log.Error("failed to get ML analysis", sl.Err(err))
@@ -159,6 +180,27 @@ func prepareMLRequest(address string, transactions []moralis.Transaction) MLRequ
 	}
 }
 
+func prepareMLColumnarRequest(address string, transactions []moralis.Transaction) MLColumnarRequest {
+	columns := MLColumnarBatch{
+		Timestamp: make([]int64, 0, len(transactions)),
+		Value:     make([]float64, 0, len(transactions)),
+		Method:    make([]string, 0, len(transactions)),
+		To:        make([]string, 0, len(transactions)),
+	}
+
+	for _, tx := range transactions {
+		columns.Timestamp = append(columns.Timestamp, tx.BlockTimestamp.Unix())
+		columns.Value = append(columns.Value, parseValue(tx.Value))
+		columns.Method = append(columns.Method, tx.MethodLabel)
+		columns.To = append(columns.To, tx.ToAddress)
+	}
+
+	return MLColumnarRequest{
+		Address: address,
+		Columns: columns,
+	}
+}
+
 func parseValue(valueStr string) float64 {
 	// Implement your value parsing logic here
 	// This is a placeholder implementation
@@ -170,7 +212,7 @@ func parseValue(valueStr string) float64 {
 	return value
 }
 
-func sendToMLService(mlServiceURL string, request MLRequest) (interface{}, error) {
+func sendToMLService(mlServiceURL string, request interface{}) (interface{}, error) {
 	requestBody, err := json.Marshal(request)
 	if err != nil {
 		return nil, fmt.Errorf("failed to marshal ML request: %w", err)
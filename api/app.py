@@ -1,11 +1,21 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import joblib
+from typing import List, Dict, Iterable, Optional, Tuple
 import numpy as np
-from wallet_similarity import WalletSimilarity
-import pandas as pd
-from datetime import datetime
+import os
+import time
+import asyncio
+import threading
+import hmac
+from contextlib import nullcontext
+from collections import Counter
+from features import TransactionColumns, FeatureAccumulator, extract_features, GRAPH_FEATURE_NAMES
+from wire_format import decode_wallet_request, UnsupportedWireFormat
+from streaming import TransactionSource, ConfidenceTracker, moralis_page_to_columns, prefetch_pages
+from model_registry import ModelRegistry, ModelBundle
+from single_flight import SingleFlight
+from deadline import Deadline, SimilarityGate, DEADLINE_HEADER, DEGRADED_DEADLINE, DEGRADED_TIMEOUT
 import logging
 import traceback
 
@@ -21,156 +31,445 @@ app = FastAPI(title="Blockchain Wallet Analyzer")
 # Загрузка моделей
 try:
     logger.info("Loading models...")
-    classifier = joblib.load('train/blockchain_classifier.joblib')
-    scaler = joblib.load('train/scaler.joblib')
-    similarity_engine = WalletSimilarity()
-    similarity_engine.load_data()
-    logger.info("Building similarity index...")
-    similarity_engine.build_index()  # Строим индекс
+    # Режим поиска похожих кошельков:
+    # local - индекс строится в каждом воркере, service - общий процесс (SIMILARITY_SOCKET),
+    # disabled - без поиска похожих (не импортируются wallet_similarity, faiss и torch)
+    similarity_socket = os.getenv('SIMILARITY_SOCKET')
+    similarity_mode = os.getenv('SIMILARITY_MODE', 'service' if similarity_socket else 'local')
+    # text - эмбеддинги описаний и Faiss, counterparty - пересечение контрагентов (MinHash/LSH)
+    similarity_backend = os.getenv('SIMILARITY_BACKEND', 'text')
+    shared_similarity = None
+    if similarity_mode == 'service':
+        # Индекс и модель живут в отдельном процессе, общем для всех воркеров
+        from similarity_service import SimilarityClient, DEFAULT_SOCKET_PATH
+        similarity_socket = similarity_socket or DEFAULT_SOCKET_PATH
+        logger.info(f"Using similarity service at {similarity_socket}")
+        shared_similarity = SimilarityClient(similarity_socket, backend=similarity_backend)
+    elif similarity_mode not in ('local', 'disabled'):
+        raise ValueError(f"Unknown SIMILARITY_MODE: {similarity_mode}")
+    
+    registry = ModelRegistry(
+        os.getenv('MODEL_REGISTRY_DIR', 'models'),
+        shared_similarity=shared_similarity,
+        similarity_enabled=similarity_mode != 'disabled',
+        similarity_backend=similarity_backend
+    )
+    registry.load()
+    
+    watch_interval = os.getenv('MODEL_WATCH_INTERVAL')
+    if watch_interval:
+        registry.start_watcher(float(watch_interval))
     logger.info("Models loaded successfully")
 except Exception as e:
     logger.error(f"Error loading models: {str(e)}")
     logger.error(traceback.format_exc())
     raise
 
-class WalletRequest(BaseModel):
-    address: str
-    transactions: List[Dict]
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# Сколько похожих кошельков запрашивать при низкой уверенности
+SIMILAR_WALLETS_K = int(os.getenv('SIMILAR_WALLETS_K', 5))
+# Одинаковые одновременные запросы /analyze считают признаки и классификатор один раз
+COALESCE_REQUESTS = os.getenv('COALESCE_REQUESTS', '1') != '0'
+analyze_flight = SingleFlight()
+# Локальные модель и индекс не гарантируют потокобезопасность (сервис похожих кошельков сериализует запросы сам)
+similarity_lock = threading.Lock() if shared_similarity is None else nullcontext()
+# Наибольшее число страниц Moralis, которое /analyze/address загружает за один запрос
+MAX_PAGES_LIMIT = int(os.getenv('MAX_PAGES_LIMIT', 50))
+# Дедлайн запроса по умолчанию, если его нет в заголовке X-Request-Deadline-Ms (0 - без дедлайна)
+REQUEST_DEADLINE_MS = float(os.getenv('REQUEST_DEADLINE_MS', 0))
+similarity_gate = SimilarityGate(
+    budget_ms=float(os.getenv('SIMILARITY_BUDGET_MS', 200)),
+    max_concurrent=int(os.getenv('SIMILARITY_MAX_CONCURRENT', 4)),
+    reserve_ms=float(os.getenv('RESPONSE_RESERVE_MS', 10))
+)
 
 class ClassificationResult(BaseModel):
     predicted_class: str
     confidence: float
     similar_wallets: Optional[List[Dict]] = None
+    neighbour_label_counts: Optional[Dict[str, int]] = None
+    model_version: Optional[str] = None
+    # Ответ классификатора без поиска похожих кошельков: не хватило времени до дедлайна или мощности
+    degraded: bool = False
+    degraded_reason: Optional[str] = None
+
+class StreamingClassificationResult(ClassificationResult):
+    transaction_count: int
+    pages_fetched: int
+    stopped_early: bool
+
+def get_transaction_source() -> TransactionSource:
+    """Источник транзакций для /analyze/address; в тестах подменяется через app.dependency_overrides"""
+    from data.moralis_api import MoralisAPI
+    return MoralisAPI()
+
+def upstream_error_status(error: Exception) -> Optional[int]:
+    """Код ответа для ошибки источника транзакций: 504 при таймауте, 502 при остальных ошибках HTTP"""
+    import httpx
+    if isinstance(error, httpx.TimeoutException):
+        return 504
+    if isinstance(error, httpx.HTTPError):
+        return 502
+    return None
 
-def extract_features(transactions: List[Dict], wallet_address: str) -> np.ndarray:
-    """Извлекает признаки из транзакций для классификации"""
+def get_deadline(header_value: Optional[str]) -> Optional[Deadline]:
     try:
-        logger.debug(f"Extracting features from {len(transactions)} transactions")
-        # Добавляем адрес в каждую транзакцию
-        for tx in transactions:
-            tx['address'] = wallet_address
-            
-        df = pd.DataFrame(transactions)
-        logger.debug(f"DataFrame created with columns: {df.columns.tolist()}")
-        
-        # Преобразуем timestamp в datetime
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-        
-        # Группируем данные по адресу
-        grouped = df.groupby('address').agg({
-            'timestamp': ['count', 'min', 'max'],
-            'value': ['mean', 'sum', 'std', 'min', 'max'],
-            'method': lambda x: x.nunique()
-        }).reset_index()
-        
-        logger.debug(f"Grouped data shape: {grouped.shape}")
-        
-        # Переименовываем колонки
-        grouped.columns = ['address', 'transaction_count', 'first_transaction', 
-                          'last_transaction', 'mean_value', 'total_value', 'value_std', 
-                          'min_value', 'max_value', 'unique_methods']
-        
-        # Добавляем временные признаки
-        grouped['transaction_duration'] = (grouped['last_transaction'] - grouped['first_transaction']).dt.total_seconds()
-        grouped['transaction_duration'] = grouped['transaction_duration'].fillna(0)
-        grouped['avg_transaction_interval'] = grouped['transaction_duration'] / grouped['transaction_count']
-        grouped['avg_transaction_interval'] = grouped['avg_transaction_interval'].fillna(0)
-        
-        # Добавляем дополнительные признаки как в train_classifier.py
-        grouped['value_range'] = grouped['max_value'] - grouped['min_value']
-        grouped['value_std_norm'] = np.where(
-            grouped['mean_value'].abs() > 1e-8,
-            grouped['value_std'] / grouped['mean_value'],
-            0.0
+        return Deadline.from_header(header_value, REQUEST_DEADLINE_MS)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {DEADLINE_HEADER} header: {header_value}")
+
+def model_features(address: str, features: np.ndarray, bundle: ModelBundle,
+                   counterparties: Optional[Iterable[str]],
+                   deadline: Optional[Deadline] = None) -> Tuple[np.ndarray, Optional[str]]:
+    """
+    Добавляет к признакам транзакций признаки графа контрагентов, если классификатор обучен с ними
+
+    Возвращает (признаки, причина degraded или None). Признаки графа ждут не дольше дедлайна:
+    если времени не осталось или сервис похожих кошельков не ответил вовремя, вместо них нули.
+    """
+    expected = getattr(bundle.scaler, 'n_features_in_', features.shape[1])
+    if expected == features.shape[1]:
+        return features, None
+    engine = bundle.similarity_engine
+    if (expected != features.shape[1] + len(GRAPH_FEATURE_NAMES)
+            or not getattr(engine, 'uses_counterparties', False) or not hasattr(engine, 'graph_features')):
+        raise ValueError(f"Model expects {expected} features; graph features require SIMILARITY_BACKEND=counterparty")
+    
+    graph_features = np.zeros((1, len(GRAPH_FEATURE_NAMES)))
+    reason = None
+    if deadline is not None and deadline.remaining() - similarity_gate.reserve <= 0:
+        reason = DEGRADED_DEADLINE
+    else:
+        kwargs = {}
+        if shared_similarity is not None:
+            kwargs['timeout'] = similarity_gate.timeout_for(deadline)
+        try:
+            graph_features = engine.graph_features(address, counterparties, **kwargs)
+        except TimeoutError:
+            reason = DEGRADED_TIMEOUT
+    if reason is not None:
+        logger.warning(f"Graph features unavailable ({reason}), using zeros")
+    return np.hstack([features, graph_features]), reason
+
+def predict(features: np.ndarray, bundle: ModelBundle) -> Tuple[str, float]:
+    """Предсказание классификатора и его уверенность"""
+    classifier, scaler = bundle.classifier, bundle.scaler
+    
+    # Масштабируем признаки
+    scaled_features = scaler.transform(features)
+    logger.debug(f"Features scaled: {scaled_features}")
+    
+    # Получаем предсказания и вероятности
+    prediction = classifier.predict(scaled_features)[0]
+    probabilities = classifier.predict_proba(scaled_features)[0]
+    confidence = max(probabilities)
+    
+    logger.info(f"Prediction: {prediction}, Confidence: {confidence}")
+    return prediction, confidence
+
+async def find_similar_within_deadline(address: str, bundle: ModelBundle,
+                                       labels: Optional[List[str]], exclude_labels: Optional[List[str]],
+                                       deadline: Optional[Deadline],
+                                       counterparties: Optional[Iterable[str]] = None) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """
+    Ищет похожие кошельки, если до дедлайна хватает времени и не превышен лимит одновременных поисков
+
+    Возвращает (похожие кошельки, None) или (None, причина отказа). Запрос не ждет поиск
+    дольше дедлайна: соединение с сервисом похожих кошельков закрывается, и сервис не начинает
+    запрос, если до него не дошла очередь; локальный поиск, еще ждущий очереди, не запускается.
+    """
+    reason = similarity_gate.acquire(deadline)
+    if reason is not None:
+        return None, reason
+    
+    timeout = similarity_gate.timeout_for(deadline)
+    cancelled = threading.Event()
+    engine = bundle.similarity_engine
+    kwargs = {}
+    if shared_similarity is not None:
+        kwargs['timeout'] = timeout
+    if getattr(engine, 'uses_counterparties', False):
+        kwargs['counterparties'] = counterparties
+    
+    def search():
+        duration = None
+        try:
+            with similarity_lock:
+                if cancelled.is_set():
+                    return None
+                start = time.perf_counter()
+                result = engine.find_similar_wallets(
+                    address, k=SIMILAR_WALLETS_K, labels=labels, exclude_labels=exclude_labels, **kwargs
+                )
+                duration = time.perf_counter() - start
+                return result
+        finally:
+            similarity_gate.release(duration)
+    
+    try:
+        # asyncio.to_thread, в отличие от run_in_threadpool, позволяет перестать ждать поток по таймауту
+        return await asyncio.wait_for(asyncio.to_thread(search), timeout), None
+    except TimeoutError:
+        cancelled.set()
+        similarity_gate.timed_out()
+        return None, DEGRADED_TIMEOUT
+
+async def run_classifier(address: str, features: np.ndarray, bundle: ModelBundle,
+                         counterparties: Optional[Iterable[str]] = None,
+                         deadline: Optional[Deadline] = None) -> Tuple[str, float, Optional[str]]:
+    """
+    Предсказание классификатора по признакам транзакций (в пуле потоков)
+
+    Возвращает (класс, уверенность, причина degraded признаков графа или None).
+    """
+    def run():
+        full_features, degraded_reason = model_features(address, features, bundle, counterparties, deadline)
+        return (*predict(full_features, bundle), degraded_reason)
+    
+    return await run_in_threadpool(run)
+
+async def apply_similarity(address: str, bundle: ModelBundle, prediction: str, confidence: float,
+                           features_degraded_reason: Optional[str] = None,
+                           labels: Optional[List[str]] = None,
+                           exclude_labels: Optional[List[str]] = None,
+                           deadline: Optional[Deadline] = None,
+                           counterparties: Optional[Iterable[str]] = None) -> ClassificationResult:
+    """
+    Уточняет предсказание классификатора по похожим кошелькам, если уверенность низкая
+
+    labels/exclude_labels ограничивают метки кошельков, среди которых ищутся похожие.
+    Если до дедлайна не хватает времени на поиск похожих кошельков, возвращается
+    ответ классификатора с degraded=True. counterparties - адреса получателей транзакций
+    кошелька (для бэкенда counterparty).
+    """
+    if features_degraded_reason is not None:
+        similarity_gate.degrade(features_degraded_reason)
+    neighbour_label_counts = None
+    degraded_reason = None
+    
+    # Если уверенность низкая, ищем похожие кошельки
+    if confidence < 0.5 and bundle.similarity_engine is not None:
+        logger.info("Low confidence, searching for similar wallets")
+        similar_wallets, degraded_reason = await find_similar_within_deadline(
+            address, bundle, labels, exclude_labels, deadline, counterparties
         )
+        if degraded_reason is not None:
+            logger.warning(f"Similarity search skipped ({degraded_reason}), returning classifier result")
+            similar_wallets = []
+        else:
+            neighbour_label_counts = dict(Counter(str(wallet['label']) for wallet in similar_wallets))
         
-        grouped['transaction_intensity'] = np.where(
-            grouped['transaction_duration'] > 0,
-            grouped['transaction_count'] / grouped['transaction_duration'],
-            0.0
-        )
+        if similar_wallets:
+            # Берем метку от самого похожего кошелька
+            most_similar_label = similar_wallets[0]['label']
+            logger.info(f"Using label from most similar wallet: {most_similar_label}")
+            prediction = most_similar_label
+            confidence = 0.5  # Устанавливаем уверенность на пороговое значение
+        elif degraded_reason is None:
+            logger.warning("No similar wallets found, keeping original prediction")
+    
+    degraded_reason = degraded_reason or features_degraded_reason
+    return ClassificationResult(
+        predicted_class=prediction,
+        confidence=float(confidence),
+        neighbour_label_counts=neighbour_label_counts,
+        model_version=bundle.version,
+        degraded=degraded_reason is not None,
+        degraded_reason=degraded_reason
+    )
+
+async def classify_features(address: str, features: np.ndarray, bundle: ModelBundle,
+                            labels: Optional[List[str]] = None,
+                            exclude_labels: Optional[List[str]] = None,
+                            deadline: Optional[Deadline] = None,
+                            counterparties: Optional[Iterable[str]] = None) -> ClassificationResult:
+    """Классифицирует кошелек по уже извлеченным признакам (аргументы - как в apply_similarity)"""
+    stage = await run_classifier(address, features, bundle, counterparties, deadline)
+    return await apply_similarity(address, bundle, *stage, labels, exclude_labels, deadline, counterparties)
+
+@app.post("/analyze", response_model=ClassificationResult)
+async def analyze_wallet(request: Request,
+                         labels: Optional[List[str]] = Query(default=None),
+                         exclude_labels: Optional[List[str]] = Query(default=None)):
+    """
+    Принимает транзакции в построчном ({"address", "transactions": [...]})
+    или колоночном ({"address", "columns": {"timestamp", "value", "method", "to"}}) виде.
+    Тело может быть JSON, msgpack или Arrow IPC stream (по Content-Type).
+
+    labels/exclude_labels ограничивают метки похожих кошельков при низкой уверенности.
+    Одновременные запросы с тем же адресом и набором транзакций ждут одного расчета признаков
+    и классификатора; поиск похожих кошельков каждый запрос выполняет со своими фильтрами и дедлайном.
+    Заголовок X-Request-Deadline-Ms задает оставшееся время на ответ: если его не хватает
+    на поиск похожих кошельков, возвращается ответ классификатора с degraded=True.
+    """
+    deadline = get_deadline(request.headers.get(DEADLINE_HEADER))
+    body = await request.body()
+    try:
+        address, columns = decode_wallet_request(body, request.headers.get('content-type'))
+    except UnsupportedWireFormat as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        logger.info(f"Analyzing wallet: {address} ({len(columns)} transactions)")
+        # Запрос дорабатывает на той версии моделей, которая была активна при его получении
+        bundle = registry.active
+        
+        counterparties = columns.to.tolist()
         
-        # Извлекаем признаки из адреса
-        features = []
-        for _, row in grouped.iterrows():
-            try:
-                features.append([
-                    row['transaction_count'],
-                    row['mean_value'],
-                    row['total_value'],
-                    row['value_std'],
-                    row['min_value'],
-                    row['max_value'],
-                    row['value_range'],
-                    row['value_std_norm'],
-                    row['unique_methods'],
-                    row['transaction_duration'],
-                    row['avg_transaction_interval'],
-                    row['transaction_intensity'],
-                    len(row['address']),
-                    int(row['address'][2:4], 16),
-                    int(row['address'][-4:], 16)
-                ])
-            except Exception as e:
-                logger.error(f"Error processing row: {row}")
-                logger.error(f"Error details: {str(e)}")
-                raise
+        async def classifier_stage():
+            # Извлекаем признаки (в пуле потоков, чтобы не блокировать цикл событий)
+            features = await run_in_threadpool(extract_features, columns, address)
+            logger.debug(f"Features extracted: {features}")
+            return await run_classifier(address, features, bundle, counterparties, deadline)
         
-        logger.debug(f"Extracted features shape: {np.array(features).shape}")
-        return np.array(features)
+        if COALESCE_REQUESTS:
+            # Без ответа классификатора отвечать нечем, а свой расчет не закончился бы раньше общего,
+            # поэтому общий расчет ждут без таймаута; дедлайн запроса ограничивает только поиск похожих
+            key = (bundle.version, address, columns.fingerprint())
+            stage = await analyze_flight.do(key, classifier_stage)
+        else:
+            stage = await classifier_stage()
+        return await apply_similarity(address, bundle, *stage, labels, exclude_labels, deadline, counterparties)
         
     except Exception as e:
-        logger.error(f"Error in extract_features: {str(e)}")
+        logger.error(f"Error in analyze_wallet: {str(e)}")
         logger.error(traceback.format_exc())
-        raise
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/analyze", response_model=ClassificationResult)
-async def analyze_wallet(wallet_request: WalletRequest):
+def update_with_page(accumulator: FeatureAccumulator, page: List[Dict], bundle: ModelBundle,
+                     early_stop: bool, deadline: Optional[Deadline]) -> Optional[Tuple[str, float]]:
+    """
+    Учитывает страницу транзакций в агрегатах и при early_stop возвращает текущее предсказание
+
+    Если признаки графа контрагентов не успели посчитаться, предсказание не возвращается:
+    ответ по нулевым признакам не должен останавливать загрузку страниц.
+    """
+    accumulator.update(moralis_page_to_columns(page))
+    if not early_stop or accumulator.transaction_count == 0:
+        return None
+    
+    page_features, degraded_reason = model_features(accumulator.wallet_address, accumulator.features(), bundle,
+                                                    accumulator.counterparties, deadline)
+    if degraded_reason is not None:
+        similarity_gate.degrade(degraded_reason)
+        return None
+    probabilities = bundle.classifier.predict_proba(bundle.scaler.transform(page_features))[0]
+    best = int(np.argmax(probabilities))
+    return bundle.classifier.classes_[best], probabilities[best]
+
+@app.get("/analyze/address/{address}", response_model=StreamingClassificationResult)
+async def analyze_address(address: str, chain: str = "eth",
+                          max_pages: int = Query(default=10, ge=1, le=MAX_PAGES_LIMIT),
+                          early_stop: bool = True,
+                          labels: Optional[List[str]] = Query(default=None),
+                          exclude_labels: Optional[List[str]] = Query(default=None),
+                          source: TransactionSource = Depends(get_transaction_source),
+                          x_request_deadline_ms: Optional[str] = Header(default=None)):
+    """
+    Сам загружает транзакции адреса и классифицирует кошелек
+
+    Страницы учитываются в накопительных агрегатах по мере поступления, следующая
+    страница загружается параллельно с обработкой текущей. При early_stop загрузка
+    прекращается, как только предсказание классификатора стабилизировалось.
+    """
+    deadline = get_deadline(x_request_deadline_ms)
     try:
-        logger.info(f"Analyzing wallet: {wallet_request.address}")
-        logger.debug(f"Request data: {wallet_request.dict()}")
-        
-        # Извлекаем признаки
-        features = extract_features(wallet_request.transactions, wallet_request.address)
-        logger.debug(f"Features extracted: {features}")
-        
-        # Масштабируем признаки
-        scaled_features = scaler.transform(features)
-        logger.debug(f"Features scaled: {scaled_features}")
+        logger.info(f"Streaming analysis of wallet: {address}")
+        bundle = registry.active
+        accumulator = FeatureAccumulator(address)
+        tracker = ConfidenceTracker()
+        pages_fetched = 0
+        stopped_early = False
         
-        # Получаем предсказания и вероятности
-        prediction = classifier.predict(scaled_features)[0]
-        probabilities = classifier.predict_proba(scaled_features)[0]
-        confidence = max(probabilities)
+        pages = prefetch_pages(source.iter_transaction_pages(address, chain, max_pages))
+        try:
+            async for page in pages:
+                pages_fetched += 1
+                # Агрегаты и предсказание считаются в пуле потоков, пока загружается следующая страница
+                page_prediction = await run_in_threadpool(
+                    update_with_page, accumulator, page, bundle, early_stop, deadline
+                )
+                if page_prediction is None:
+                    continue
+                if tracker.update(*page_prediction):
+                    logger.info(f"Prediction stable after {pages_fetched} pages, stopping fetch")
+                    stopped_early = True
+                    break
+        finally:
+            await pages.aclose()
         
-        logger.info(f"Prediction: {prediction}, Confidence: {confidence}")
+        if accumulator.transaction_count == 0:
+            raise HTTPException(status_code=404, detail="No transactions found for address")
         
-        # Если уверенность низкая, ищем похожие кошельки
-        if confidence < 0.5:
-            logger.info("Low confidence, searching for similar wallets")
-            similar_wallets = similarity_engine.find_similar_wallets(wallet_request.address, k=1)  # Берем только самый похожий
-            
-            if similar_wallets:
-                # Берем метку от самого похожего кошелька
-                most_similar_label = similar_wallets[0]['label']
-                logger.info(f"Using label from most similar wallet: {most_similar_label}")
-                prediction = most_similar_label
-                confidence = 0.5  # Устанавливаем уверенность на пороговое значение
-            else:
-                logger.warning("No similar wallets found, keeping original prediction")
-        
-        result = ClassificationResult(
-            predicted_class=prediction,
-            confidence=float(confidence)
+        result = await classify_features(address, accumulator.features(), bundle, labels, exclude_labels, deadline,
+                                         counterparties=accumulator.counterparties)
+        return StreamingClassificationResult(
+            **result.model_dump(),
+            transaction_count=accumulator.transaction_count,
+            pages_fetched=pages_fetched,
+            stopped_early=stopped_early
         )
         
-        return result
-        
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in analyze_wallet: {str(e)}")
+        logger.error(f"Error in analyze_address: {str(e)}")
         logger.error(traceback.format_exc())
+        status_code = upstream_error_status(e)
+        if status_code is not None:
+            raise HTTPException(status_code=status_code, detail=f"Transaction source error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def check_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Административные эндпоинты требуют заголовок X-Admin-Token, совпадающий с ADMIN_TOKEN
+
+    Без ADMIN_TOKEN они отключены: перезагрузку и откат моделей нельзя выполнить без авторизации.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled: ADMIN_TOKEN is not set")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/models", dependencies=[Depends(check_admin_token)])
+async def list_models():
+    return {
+        "active_version": registry.active.version,
+        "load_timings": registry.active.load_timings,
+        "loading_version": registry.loading_version,
+        "last_error": registry.last_error,
+        "failed_version": registry.failed_version,
+        "available_versions": registry.list_versions()
+    }
+
+@app.post("/admin/models/reload", status_code=202, dependencies=[Depends(check_admin_token)])
+async def reload_models(version: Optional[str] = None, pin: bool = True):
+    """
+    Загружает версию моделей в фоне (по умолчанию - из CURRENT или последнюю) и атомарно подменяет активную
+
+    При pin явно указанная версия записывается в CURRENT, когда она успешно загрузится.
+    """
+    try:
+        # CURRENT записывается после успешной загрузки; остальные воркеры переключатся через наблюдатель за реестром
+        version = registry.reload_async(version, pin=pin and version is not None)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "loading", "version": version, "active_version": registry.active.version}
+
+@app.get("/admin/coalescing", dependencies=[Depends(check_admin_token)])
+async def coalescing_stats():
+    """Сколько запросов /analyze было объединено с уже выполняющимися"""
+    return {"enabled": COALESCE_REQUESTS, **analyze_flight.stats()}
+
+@app.get("/admin/similarity", dependencies=[Depends(check_admin_token)])
+async def similarity_stats():
+    """Ожидаемая длительность поиска похожих кошельков, текущая нагрузка и число ответов без него"""
+    return {"enabled": registry.active.similarity_engine is not None, **similarity_gate.stats()}
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy", "model_version": registry.active.version} 
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Бенчмарк кодировщика описаний кошельков
+
+Сравнивает стандартную модель SentenceTransformer (torch) с ONNX-бэкендом
+по скорости и проверяет, что эмбеддинги согласуются по косинусной близости.
+
+Запуск:
+    python benchmark_encoder.py --data data/data.csv --threads 4
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from wallet_similarity import SentenceEncoder, WalletSimilarity, export_onnx
+
+
+def timed_encode(encoder: SentenceEncoder, texts):
+    start = time.perf_counter()
+    embeddings = encoder.encode(texts)
+    return embeddings, time.perf_counter() - start
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Косинусная близость между соответствующими строками двух матриц эмбеддингов"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return (reference * candidate).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк кодировщиков эмбеддингов")
+    parser.add_argument('--data', default='data/data.csv')
+    parser.add_argument('--limit', type=int, default=2000, help="Максимум описаний кошельков")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--onnx-path', default=None, help="Готовая ONNX модель; если не задана, модель экспортируется")
+    parser.add_argument('--onnx-dir', default='models/onnx')
+    parser.add_argument('--no-quantize', action='store_true')
+    parser.add_argument('--min-cosine', type=float, default=0.98, help="Минимальная средняя косинусная близость")
+    args = parser.parse_args()
+
+    # Кэш отключен, чтобы измерять само кодирование
+    reference = SentenceEncoder(backend='torch', batch_size=args.batch_size,
+                                num_threads=args.threads, cache_size=0)
+
+    similarity = WalletSimilarity(encoder=reference)
+    similarity.load_data(args.data)
+    texts = list(similarity.wallet_descriptions.values())[:args.limit]
+    print(f"Описаний для кодирования: {len(texts)}")
+
+    onnx_path = args.onnx_path
+    if onnx_path is None or not os.path.exists(onnx_path):
+        print(f"Экспорт модели в ONNX ({args.onnx_dir})...")
+        onnx_path = export_onnx(args.onnx_dir, quantize=not args.no_quantize)
+
+    candidate = SentenceEncoder(backend='onnx', batch_size=args.batch_size,
+                                num_threads=args.threads, onnx_path=onnx_path, cache_size=0)
+
+    # Прогрев, чтобы не учитывать ленивую инициализацию
+    reference.encode(texts[:8])
+    candidate.encode(texts[:8])
+
+    reference_embeddings, reference_time = timed_encode(reference, texts)
+    candidate_embeddings, candidate_time = timed_encode(candidate, texts)
+
+    cached = SentenceEncoder(backend='onnx', batch_size=args.batch_size,
+                             num_threads=args.threads, onnx_path=onnx_path, cache_size=len(texts))
+    cached.encode(texts)
+    _, cached_time = timed_encode(cached, texts)
+
+    cosines = cosine_agreement(reference_embeddings, candidate_embeddings)
+
+    print(f"\n{'backend':<20}{'total, s':>12}{'texts/s':>12}")
+    for name, elapsed in [('torch', reference_time), (os.path.basename(onnx_path), candidate_time),
+                          ('onnx + cache', cached_time)]:
+        print(f"{name:<20}{elapsed:>12.3f}{len(texts) / max(elapsed, 1e-9):>12.1f}")
+
+    print(f"\nУскорение ONNX: {reference_time / max(candidate_time, 1e-9):.2f}x")
+    print(f"Косинусная близость: средняя {cosines.mean():.5f}, минимальная {cosines.min():.5f}")
+
+    if cosines.mean() < args.min_cosine:
+        print(f"Средняя близость ниже порога {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
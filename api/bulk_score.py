@@ -0,0 +1,250 @@
+"""
+Пакетная переразметка кошельков без HTTP API
+
+Читает транзакции (CSV или Parquet) порциями, считает признаки и предсказания
+в пуле процессов (модель загружается один раз на процесс) и дописывает
+результаты в CSV по мере готовности. Память ограничена размером порции и
+числом одновременно обрабатываемых порций, а не размером входного файла.
+
+Транзакции одного адреса должны идти подряд (файл отсортирован или сгруппирован
+по адресу): адрес на границе порции переносится в следующую порцию целиком.
+
+Прерванный запуск продолжается с той же командой: прогресс хранится в
+<output>.progress, выходной файл обрезается до последней записанной порции.
+
+Запуск:
+    python bulk_score.py --input data/data.csv --output predictions.csv --workers 8
+    python bulk_score.py --input transactions.parquet --output predictions.csv --version 2025-05-01
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Optional
+import numpy as np
+import pandas as pd
+from features import FEATURE_NAMES, compute_features
+from model_registry import ModelRegistry
+
+INPUT_COLUMNS = ['address', 'timestamp', 'value', 'method', 'to']
+OUTPUT_COLUMNS = ['address', 'status', 'predicted_class', 'confidence', 'transaction_count', 'model_version']
+
+# Значения колонки status: кошелек классифицирован или причина, по которой предсказания нет
+STATUS_SCORED = 'scored'
+STATUS_NO_TIMESTAMPS = 'no_valid_timestamps'  # API отвечает на такой запрос ошибкой
+STATUS_INVALID_ADDRESS = 'invalid_address'
+STATUS_MISSING_VALUES = 'missing_values'  # неполные признаки, а модель не принимает пропуски
+
+# Модель воркера: загружается один раз в initializer пула
+_bundle = None
+
+
+def read_chunks(path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Читает входной файл порциями примерно по chunk_rows строк"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=INPUT_COLUMNS):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=INPUT_COLUMNS, chunksize=chunk_rows)
+
+
+def address_chunks(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Перегруппировывает порции так, чтобы транзакции одного адреса не попадали в разные порции
+
+    Строки последнего адреса порции переносятся в начало следующей.
+    """
+    carry: Optional[pd.DataFrame] = None
+    warned = False
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+
+        addresses = chunk['address']
+        if not warned and (addresses != addresses.shift()).sum() != addresses.nunique():
+            print("Внимание: транзакции одного адреса идут не подряд, предсказания для таких адресов будут дублироваться")
+            warned = True
+
+        last_address = addresses.iloc[-1]
+        tail_start = len(chunk)
+        while tail_start > 0 and addresses.iloc[tail_start - 1] == last_address:
+            tail_start -= 1
+        carry = chunk.iloc[tail_start:]
+        if tail_start > 0:
+            yield chunk.iloc[:tail_start]
+
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def _init_worker(registry_dir: str, version: str):
+    global _bundle
+    # Поиск похожих кошельков при пакетной разметке не используется
+    _bundle = ModelRegistry(registry_dir, similarity_enabled=False).load(version)
+
+
+def score_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Считает признаки (как features.extract_features) и предсказания для всех адресов порции
+
+    Каждый адрес порции попадает в результат: для адресов без предсказания
+    колонка status содержит причину.
+    """
+    if getattr(_bundle.scaler, 'n_features_in_', len(FEATURE_NAMES)) != len(FEATURE_NAMES):
+        raise ValueError(f"Model version {_bundle.version} uses graph features, which bulk scoring does not compute")
+    chunk = chunk.assign(
+        timestamp=pd.to_numeric(chunk['timestamp'], errors='coerce'),
+        value=pd.to_numeric(chunk['value'], errors='coerce')
+    )
+    grouped = chunk.groupby('address', sort=False).agg(
+        transaction_count=('timestamp', 'count'),
+        first_transaction=('timestamp', 'min'),
+        last_transaction=('timestamp', 'max'),
+        mean_value=('value', 'mean'),
+        total_value=('value', 'sum'),
+        value_std=('value', 'std'),
+        min_value=('value', 'min'),
+        max_value=('value', 'max'),
+        unique_methods=('method', 'nunique')
+    )
+
+    status = np.full(len(grouped), STATUS_SCORED, dtype=object)
+    features = np.full((len(grouped), len(FEATURE_NAMES)), np.nan)
+    for i, (address, aggregates) in enumerate(zip(grouped.index, grouped.itertuples(index=False))):
+        if aggregates.transaction_count == 0:
+            status[i] = STATUS_NO_TIMESTAMPS
+            continue
+        try:
+            features[i] = compute_features(**aggregates._asdict(), wallet_address=address)
+        except ValueError:
+            status[i] = STATUS_INVALID_ADDRESS
+
+    # Неполные признаки (например, одна транзакция - нет std) передаются модели как есть, как и в API;
+    # отдельно от полных, чтобы модель без поддержки пропусков не сорвала всю порцию
+    classes = _bundle.classifier.classes_
+    predicted = np.full(len(grouped), None, dtype=object)
+    confidence = np.full(len(grouped), np.nan)
+    finite = np.isfinite(features).all(axis=1)
+    for rows in (np.flatnonzero((status == STATUS_SCORED) & finite),
+                 np.flatnonzero((status == STATUS_SCORED) & ~finite)):
+        if len(rows) == 0:
+            continue
+        try:
+            probabilities = _bundle.classifier.predict_proba(_bundle.scaler.transform(features[rows]))
+        except ValueError:
+            status[rows] = STATUS_MISSING_VALUES
+            continue
+        best = probabilities.argmax(axis=1)
+        predicted[rows] = classes[best]
+        confidence[rows] = probabilities[np.arange(len(best)), best]
+
+    return pd.DataFrame({
+        'address': grouped.index,
+        'status': status,
+        'predicted_class': predicted,
+        'confidence': confidence,
+        'transaction_count': grouped['transaction_count'].to_numpy(),
+        'model_version': _bundle.version
+    })
+
+
+def load_progress(progress_path: str, expected: Dict) -> Dict:
+    """Читает прогресс прерванного запуска; параметры запуска должны совпадать"""
+    if not os.path.exists(progress_path):
+        return {**expected, 'chunks_done': 0, 'output_bytes': 0, 'addresses': 0, 'skipped': 0, 'rows': 0}
+    with open(progress_path) as f:
+        progress = json.load(f)
+    mismatched = [key for key, value in expected.items() if progress.get(key) != value]
+    if mismatched:
+        raise ValueError(f"Progress file {progress_path} was written with different {', '.join(mismatched)}; "
+                         f"remove it or the output file to start over")
+    return progress
+
+
+def save_progress(progress_path: str, progress: Dict):
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная классификация кошельков")
+    parser.add_argument('--input', required=True, help="CSV или Parquet с колонками address, timestamp, value, method, to")
+    parser.add_argument('--output', required=True, help="CSV с предсказаниями")
+    parser.add_argument('--registry', default=os.getenv('MODEL_REGISTRY_DIR', 'models'))
+    parser.add_argument('--version', default=None, help="Версия моделей (по умолчанию - из CURRENT или последняя)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-rows', type=int, default=200000, help="Строк транзакций в порции")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Порций в обработке одновременно (по умолчанию 2 на воркер)")
+    args = parser.parse_args()
+
+    version = args.version or ModelRegistry(args.registry).resolve_version()
+    progress_path = args.output + '.progress'
+    progress = load_progress(progress_path, {
+        'input': os.path.abspath(args.input),
+        'chunk_rows': args.chunk_rows,
+        'model_version': version,
+        'columns': OUTPUT_COLUMNS
+    })
+    if os.path.exists(args.output) and os.path.getsize(args.output) < progress['output_bytes']:
+        raise ValueError(f"{args.output} is shorter than recorded in {progress_path}; remove the progress file to start over")
+    if progress['chunks_done']:
+        print(f"Продолжение с порции {progress['chunks_done']} ({progress['addresses']} адресов уже размечено)")
+
+    max_pending = args.max_pending or 2 * args.workers
+    started = time.perf_counter()
+    addresses_at_start = progress['addresses']
+
+    with open(args.output, 'a+b') as output, ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_init_worker, initargs=(args.registry, version)
+    ) as pool:
+        # Отбрасываем то, что было записано после последнего сохранения прогресса
+        output.truncate(progress['output_bytes'])
+        if progress['output_bytes'] == 0:
+            output.write((','.join(OUTPUT_COLUMNS) + '\n').encode())
+
+        def write_result(future, rows: int):
+            result = future.result()
+            result.to_csv(output, header=False, index=False)
+            output.flush()
+            os.fsync(output.fileno())
+
+            progress['chunks_done'] += 1
+            progress['addresses'] += len(result)
+            progress['skipped'] += int((result['status'] != STATUS_SCORED).sum())
+            progress['rows'] += rows
+            progress['output_bytes'] = output.tell()
+            save_progress(progress_path, progress)
+
+            elapsed = time.perf_counter() - started
+            rate = (progress['addresses'] - addresses_at_start) / elapsed if elapsed else 0.0
+            print(f"Порций: {progress['chunks_done']}, адресов: {progress['addresses']} "
+                  f"(без предсказания: {progress['skipped']}), транзакций: {progress['rows']}, "
+                  f"{rate:.0f} адресов/с", flush=True)
+
+        # Результаты пишутся в порядке порций, поэтому прогресс - это просто число записанных порций
+        pending = deque()
+        for index, chunk in enumerate(address_chunks(read_chunks(args.input, args.chunk_rows))):
+            if index < progress['chunks_done']:
+                continue
+            if len(pending) >= max_pending:
+                write_result(*pending.popleft())
+            pending.append((pool.submit(score_chunk, chunk), len(chunk)))
+
+        while pending:
+            write_result(*pending.popleft())
+
+    print(f"Готово: {progress['addresses']} адресов за {time.perf_counter() - started:.1f} с -> {args.output}")
+    if progress['skipped']:
+        print(f"Без предсказания (см. колонку status): {progress['skipped']} адресов")
+
+
+if __name__ == "__main__":
+    main()
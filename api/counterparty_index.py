@@ -0,0 +1,286 @@
+"""
+Индекс кошельков по контрагентам (колонка `to`)
+
+Кошельки хранятся разреженной матрицей кошелек × контрагент (SciPy CSR).
+Для каждого кошелька считается MinHash-сигнатура множества контрагентов,
+сигнатуры разбиты на полосы LSH: кандидаты в соседи - кошельки, совпавшие
+с запросом хотя бы в одной полосе. Точная мера Жаккара считается только для
+кандидатов, поэтому время запроса не растет линейно с числом кошельков
+и контрагентов.
+
+CounterpartySimilarity - бэкенд поиска похожих кошельков с тем же интерфейсом,
+что и WalletSimilarity, но без модели эмбеддингов и Faiss.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from typing import Dict, Iterable, List, Optional, Tuple
+from features import GRAPH_FEATURE_NAMES, summarize_wallets
+
+_MIX_1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX_2 = np.uint64(0x94d049bb133111eb)
+_GOLDEN = np.uint64(0x9e3779b97f4a7c15)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """Перемешивание splitmix64; умножение uint64 в numpy идет по модулю 2^64"""
+    z = values + _GOLDEN
+    z = (z ^ (z >> np.uint64(30))) * _MIX_1
+    z = (z ^ (z >> np.uint64(27))) * _MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+def hash_counterparties(counterparties: np.ndarray) -> np.ndarray:
+    """Стабильный 64-битный хэш адресов контрагентов (не зависит от процесса и порядка)"""
+    return pd.util.hash_array(np.asarray(counterparties, dtype=object))
+
+
+class CounterpartyIndex:
+    def __init__(self, num_perm: int = 64, bands: int = 32, max_bucket: int = 1000, seed: int = 1):
+        """
+        Args:
+            num_perm: длина MinHash-сигнатуры
+            bands: число полос LSH (num_perm должно делиться на bands); больше полос -
+                больше кандидатов с низкой мерой Жаккара
+            max_bucket: сколько кошельков брать из одной корзины LSH (популярные контрагенты,
+                например роутер биржи, дают огромные корзины)
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.max_bucket = max_bucket
+        self.seeds = _mix(np.arange(num_perm, dtype=np.uint64) + np.uint64(seed))
+
+        self.addresses = pd.Index([])
+        self.counterparties = pd.Index([])
+        self.labels = np.empty(0, dtype=object)
+        self.matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.degree = np.empty(0, dtype=np.int64)  # сколько кошельков взаимодействовали с контрагентом
+        self.signatures = np.empty((0, num_perm), dtype=np.uint64)
+        self._band_keys: List[np.ndarray] = []
+        self._band_order: List[np.ndarray] = []
+
+    def build(self, df: pd.DataFrame):
+        """Строит индекс по транзакциям с колонками address, to и (необязательно) label"""
+        pairs = df[['address', 'to']].dropna().drop_duplicates()
+        rows, addresses = pd.factorize(pairs['address'], sort=True)
+        cols, counterparties = pd.factorize(pairs['to'], sort=True)
+        self.addresses, self.counterparties = pd.Index(addresses), pd.Index(counterparties)
+
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+            shape=(len(self.addresses), len(self.counterparties))
+        )
+        if 'label' in df.columns:
+            labels = df.groupby('address')['label'].first()
+            self.labels = labels.reindex(self.addresses).fillna("unknown").to_numpy(dtype=object)
+        else:
+            self.labels = np.full(len(self.addresses), "unknown", dtype=object)
+        self._build_hashes()
+
+    def _build_hashes(self):
+        self.degree = np.bincount(self.matrix.indices, minlength=self.matrix.shape[1])
+        self._counterparty_hashes = hash_counterparties(self.counterparties.to_numpy())
+
+        # MinHash для всех кошельков сразу: минимум по сегментам CSR для каждой перестановки
+        values = self._counterparty_hashes[self.matrix.indices]
+        starts = self.matrix.indptr[:-1]
+        self.signatures = np.empty((self.matrix.shape[0], self.num_perm), dtype=np.uint64)
+        for j, seed in enumerate(self.seeds):
+            self.signatures[:, j] = np.minimum.reduceat(_mix(values ^ seed), starts)
+
+        self._band_keys, self._band_order = [], []
+        for keys in self._bands(self.signatures):
+            order = np.argsort(keys, kind='stable')
+            self._band_keys.append(keys[order])
+            self._band_order.append(order)
+
+    def _bands(self, signatures: np.ndarray) -> List[np.ndarray]:
+        """Ключ каждой полосы сигнатуры - хэш входящих в нее значений"""
+        rows_per_band = self.num_perm // self.bands
+        keys = []
+        for band in range(self.bands):
+            key = np.full(len(signatures), np.uint64(band), dtype=np.uint64)
+            for column in signatures[:, band * rows_per_band:(band + 1) * rows_per_band].T:
+                key = _mix(key ^ column)
+            keys.append(key)
+        return keys
+
+    def signature(self, counterparties: Iterable[str]) -> np.ndarray:
+        """MinHash-сигнатура произвольного множества контрагентов (в том числе не из индекса)"""
+        hashes = hash_counterparties(np.array(list(set(counterparties)), dtype=object))
+        if len(hashes) == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        return _mix(hashes[None, :] ^ self.seeds[:, None]).min(axis=1)
+
+    def candidates(self, signature: np.ndarray) -> np.ndarray:
+        """Кошельки, совпавшие с сигнатурой хотя бы в одной полосе LSH"""
+        found = []
+        for band, key in enumerate(self._bands(signature[None, :])):
+            sorted_keys = self._band_keys[band]
+            start = np.searchsorted(sorted_keys, key[0], side='left')
+            end = np.searchsorted(sorted_keys, key[0], side='right')
+            found.append(self._band_order[band][start:min(end, start + self.max_bucket)])
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def row_counterparties(self, row: int) -> np.ndarray:
+        return self.counterparties[self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]].to_numpy()
+
+    def query(self, counterparties: Iterable[str], k: int = 5, labels: Optional[List[str]] = None,
+              exclude_row: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k кошельков с наибольшей мерой Жаккара среди кандидатов LSH
+
+        Returns:
+            (номера строк кошельков, мера Жаккара), по убыванию меры
+        """
+        query_set = set(counterparties)
+        rows = self.candidates(self.signature(query_set))
+        if exclude_row is not None:
+            rows = rows[rows != exclude_row]
+        if labels is not None:
+            rows = rows[np.isin(self.labels[rows], list(labels))]
+        if len(rows) == 0 or not query_set:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        # Пересечение считается только по известным индексу контрагентам; неизвестные увеличивают объединение
+        cols = self.counterparties.get_indexer(list(query_set))
+        cols = cols[cols >= 0]
+        candidates = self.matrix[rows]
+        intersection = np.asarray(candidates[:, cols].sum(axis=1)).ravel()
+        union = np.diff(candidates.indptr) + len(query_set) - intersection
+        jaccard = intersection / union
+
+        order = np.argsort(-jaccard, kind='stable')[:k]
+        order = order[jaccard[order] > 0]
+        return rows[order], jaccard[order]
+
+    def graph_features(self, counterparties: Iterable[str], exclude_row: Optional[int] = None) -> List[float]:
+        """
+        Признаки кошелька по графу контрагентов (порядок - GRAPH_FEATURE_NAMES)
+
+        exclude_row - строка самого кошелька, если он есть в индексе: он не учитывается
+        ни в степени контрагентов, ни среди соседей.
+        """
+        query_set = set(counterparties)
+        cols = self.counterparties.get_indexer(list(query_set))
+        degrees = np.where(cols >= 0, self.degree[cols], 0).astype(np.float64)
+        if exclude_row is not None:
+            degrees -= np.isin(cols, self.matrix.indices[self.matrix.indptr[exclude_row]:self.matrix.indptr[exclude_row + 1]])
+        _, jaccard = self.query(query_set, k=1, exclude_row=exclude_row)
+        return [
+            float(len(query_set)),
+            float(degrees.mean()) if len(degrees) else 0.0,
+            float(degrees.max()) if len(degrees) else 0.0,
+            float(jaccard[0]) if len(jaccard) else 0.0
+        ]
+
+    def graph_feature_matrix(self, addresses: Iterable[str]) -> np.ndarray:
+        """Признаки графа для кошельков из индекса (каждый без учета самого себя); неизвестные - нули"""
+        rows = self.addresses.get_indexer(list(addresses))
+        return np.array([
+            self.graph_features(self.row_counterparties(row), exclude_row=row) if row >= 0
+            else [0.0] * len(GRAPH_FEATURE_NAMES)
+            for row in rows
+        ], dtype=np.float64).reshape(len(rows), len(GRAPH_FEATURE_NAMES))
+
+    def save(self, path: str):
+        """Сохраняет индекс в .npz (сигнатуры и полосы пересчитываются при загрузке)"""
+        np.savez_compressed(
+            path,
+            addresses=self.addresses.to_numpy(dtype=str),
+            counterparties=self.counterparties.to_numpy(dtype=str),
+            labels=self.labels.astype(str),
+            indptr=self.matrix.indptr, indices=self.matrix.indices,
+            params=np.array([self.num_perm, self.bands, self.max_bucket])
+        )
+
+    def load(self, path: str):
+        with np.load(path) as data:
+            num_perm, bands, self.max_bucket = (int(v) for v in data['params'])
+            if (num_perm, bands) != (self.num_perm, self.bands):
+                raise ValueError(f"Index was built with num_perm={num_perm}, bands={bands}")
+            self.addresses = pd.Index(data['addresses'].astype(object))
+            self.counterparties = pd.Index(data['counterparties'].astype(object))
+            self.labels = data['labels'].astype(object)
+            indices, indptr = data['indices'], data['indptr']
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(self.addresses), len(self.counterparties))
+        )
+        self._build_hashes()
+
+
+class CounterpartySimilarity:
+    """Поиск похожих кошельков по пересечению контрагентов (мера Жаккара через MinHash/LSH)"""
+
+    # app передает контрагентов запрашиваемого кошелька, если бэкенд их использует
+    uses_counterparties = True
+
+    def __init__(self, **index_params):
+        self.index = CounterpartyIndex(**index_params)
+        self.wallet_summary = {}  # адрес -> метка и число транзакций
+        self.wallet_data = None
+
+    def load_data(self, csv_path: str = 'data/data.csv'):
+        """Загружает пары кошелек-контрагент из CSV и сводку по кошелькам"""
+        print(f"Loading counterparties from {csv_path}")
+        self.wallet_data = pd.read_csv(csv_path, usecols=lambda column: column in ('address', 'to', 'label'))
+        self.wallet_summary.update(summarize_wallets(self.wallet_data))
+
+    def build_index(self):
+        """Строит индекс контрагентов по данным из load_data"""
+        self.index.build(self.wallet_data)
+        print(f"Indexed {len(self.index.addresses)} wallets, {len(self.index.counterparties)} counterparties")
+
+    def save_index(self, path: str = 'counterparty_index.npz'):
+        self.index.save(path)
+
+    def load_index(self, path: str = 'counterparty_index.npz'):
+        """Загружает готовый индекс (сводка по кошелькам должна быть загружена через load_data)"""
+        self.index.load(path)
+
+    def _query_set(self, address: str, counterparties: Optional[Iterable[str]]) -> Tuple[List[str], Optional[int]]:
+        """Контрагенты запроса: переданные явно или из индекса, если кошелек в нем есть"""
+        row = self.index.addresses.get_indexer([address])[0]
+        exclude_row = row if row >= 0 else None
+        if counterparties is not None:
+            return [c for c in counterparties if isinstance(c, str) and c], exclude_row
+        if exclude_row is None:
+            return [], None
+        return list(self.index.row_counterparties(row)), exclude_row
+
+    def find_similar_wallets(self, address: str, k: int = 5, labels: Optional[List[str]] = None,
+                             exclude_labels: Optional[List[str]] = None,
+                             counterparties: Optional[Iterable[str]] = None) -> List[Dict]:
+        """
+        Находит до k кошельков с наибольшим пересечением контрагентов
+
+        Args:
+            counterparties: контрагенты запрашиваемого кошелька; если не заданы,
+                берутся из индекса (для кошельков, которых нет в индексе, результат пуст)
+        """
+        if exclude_labels:
+            excluded = set(exclude_labels)
+            labels = [label for label in (labels or np.unique(self.index.labels)) if label not in excluded]
+
+        query_set, exclude_row = self._query_set(address, counterparties)
+        rows, jaccard = self.index.query(query_set, k=k, labels=labels, exclude_row=exclude_row)
+
+        results = []
+        for row, score in zip(rows, jaccard):
+            neighbour = self.index.addresses[row]
+            summary = self.wallet_summary.get(neighbour, {'label': self.index.labels[row], 'transaction_count': 0})
+            results.append({
+                'address': neighbour,
+                'label': summary['label'],
+                'transaction_count': summary['transaction_count'],
+                'jaccard': float(score)
+            })
+        return results
+
+    def graph_features(self, address: str, counterparties: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Признаки графа контрагентов в виде строки (1, len(GRAPH_FEATURE_NAMES))"""
+        query_set, exclude_row = self._query_set(address, counterparties)
+        return np.array([self.index.graph_features(query_set, exclude_row=exclude_row)], dtype=np.float64)
@@ -0,0 +1,112 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+# Словарь кодов методов, общий для всех запусков сбора данных (хранится рядом с датасетом)
+METHODS_FILE = 'method_codes.json'
+
+# Базовые методы с фиксированными кодами
+TRANSFER = 0
+MINT = 1
+BUY = 2
+SELL = 3
+
+BASE_METHODS = ['transfer', 'mint', 'buy', 'sell']
+
+# Известные контракты NFT маркетплейсов (в нижнем регистре)
+KNOWN_MARKETPLACES = frozenset([
+    '0x7be8076f4ea4a4ad08075c2508e481d6c946d12b',  # OpenSea
+    '0x7f268357a8c2552623316e2562d90e642bb538e5',  # Wyvern
+    '0x00000000006c3852cbef3e08e8df289169ede581',  # Seaport 1.1
+    '0x00000000000000adc04c56bf30ac9d3c0aaf14dc',  # Seaport 1.5
+])
+
+SELECTOR_TRANSFER_FROM = '0x23b872dd'
+SELECTOR_MINT = '0xa0712d68'
+
+
+class MethodRegistry:
+    """
+    Таблица кодов методов транзакций
+
+    Каждый селектор получает собственный код при первой встрече (пустой input -
+    transfer), как раньше каждый селектор был отдельной строкой, поэтому число
+    уникальных методов кошелька совпадает с данными, на которых обучена модель.
+    Словарь можно сохранить рядом с датасетом, чтобы коды оставались
+    стабильными между запусками.
+    """
+
+    def __init__(self):
+        self.methods: List[str] = list(BASE_METHODS)
+        self.codes: Dict[str, int] = {name: code for code, name in enumerate(self.methods)}
+
+    @classmethod
+    def load(cls, path: str) -> 'MethodRegistry':
+        """Загружает словарь методов, сохраненный предыдущим запуском"""
+        registry = cls()
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            for name in saved['methods'][len(registry.methods):]:
+                registry.intern(name)
+        return registry
+
+    def save(self, path: str):
+        """Сохраняет словарь методов"""
+        with open(path, 'w') as f:
+            json.dump({'methods': self.methods}, f, indent=2)
+
+    def intern(self, name: str) -> int:
+        """Возвращает код метода, добавляя его в словарь при необходимости"""
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.methods)
+            self.methods.append(name)
+            self.codes[name] = code
+        return code
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Переводит коды обратно в названия методов"""
+        return np.asarray(self.methods, dtype=object)[codes]
+
+    def name(self, method) -> str:
+        """
+        Название метода по коду; значения, которые не являются известным кодом
+        (например, строковые методы старых датасетов), возвращаются как есть
+        """
+        if isinstance(method, str) and method.isdigit():
+            method = int(method)  # код, прочитанный из CSV со смешанной колонкой
+        if isinstance(method, (int, np.integer, float, np.floating)) and float(method).is_integer() \
+                and 0 <= method < len(self.methods):
+            return self.decode(np.array([int(method)]))[0]
+        return str(method)
+
+    def encode_selectors(self, inputs: pd.Series) -> np.ndarray:
+        """Кодирует input транзакций страницы по их 4-байтовому селектору"""
+        selectors = extract_selectors(inputs)
+        uniques, inverse = np.unique(selectors, return_inverse=True)
+        unique_codes = np.array([self._selector_code(s) for s in uniques], dtype=np.int32)
+        return unique_codes[inverse]
+
+    def encode_nft_methods(self, inputs: pd.Series, to_addresses: pd.Series, values: pd.Series) -> np.ndarray:
+        """Определяет методы NFT операций для страницы транзакций"""
+        selectors = extract_selectors(inputs)
+        is_marketplace = to_addresses.fillna('').str.lower().isin(KNOWN_MARKETPLACES).to_numpy()
+        return np.select(
+            [selectors == SELECTOR_TRANSFER_FROM, selectors == SELECTOR_MINT, is_marketplace],
+            [TRANSFER, MINT, np.where(values.to_numpy() > 0, BUY, SELL)],
+            default=TRANSFER
+        ).astype(np.int32)
+
+    def _selector_code(self, selector: str) -> int:
+        # Пустой input - простой перевод эфира
+        if selector == '':
+            return TRANSFER
+        return self.intern(selector)
+
+
+def extract_selectors(inputs: pd.Series) -> np.ndarray:
+    """Выделяет 4-байтовые селекторы из input транзакций"""
+    return inputs.fillna('').astype(str).str[:10].to_numpy(dtype=str)
@@ -1,6 +1,7 @@
 import requests
 import time
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, AsyncIterator
 import os
 from dotenv import load_dotenv
 
@@ -74,6 +75,65 @@ class MoralisAPI:
             
         return all_transactions
 
+    async def iter_transaction_pages(self, address: str, chain: str = "eth", max_pages: int = 10) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Асинхронно получает транзакции адреса постранично
+
+        Каждая страница отдается сразу после получения, чтобы вызывающий код
+        мог обрабатывать ее, пока загружается следующая.
+
+        Args:
+            address: Ethereum адрес
+            chain: ID блокчейна
+            max_pages: Максимальное количество страниц для получения
+
+        Yields:
+            List транзакций одной страницы
+
+        Raises:
+            httpx.HTTPError: ошибка запроса к Moralis (в том числе ответ 4xx/5xx и таймаут)
+        """
+        import httpx
+
+        url = f"{self.base_url}/{address}"
+        cursor = None
+        page = 0
+
+        async with httpx.AsyncClient(headers=self.headers, timeout=30) as client:
+            while page < max_pages:
+                params = {"chain": chain, "limit": 100}
+                if cursor:
+                    params["cursor"] = cursor
+
+                try:
+                    response = await client.get(url, params=params)
+                    response.raise_for_status()
+                    data = response.json()
+                except httpx.HTTPError as e:
+                    # Не выдаем неполную историю за полную: ошибку обрабатывает вызывающий код
+                    print(f"Ошибка при получении транзакций: {e}")
+                    raise
+
+                transactions = data.get("result", [])
+                if transactions:
+                    yield transactions
+
+                cursor = data.get("cursor")
+                if not cursor or not transactions:
+                    break
+
+                page += 1
+                await asyncio.sleep(0.2)  # Небольшая задержка между запросами
+
+    async def get_all_transactions_async(self, address: str, chain: str = "eth", max_pages: int = 10) -> List[Dict[str, Any]]:
+        """
+        Асинхронная версия get_all_transactions
+        """
+        all_transactions = []
+        async for transactions in self.iter_transaction_pages(address, chain, max_pages):
+            all_transactions.extend(transactions)
+        return all_transactions
+
     def get_token_transfers(self, address: str, chain: str = "eth") -> List[Dict[str, Any]]:
         """
         Получает историю трансферов токенов для указанного адреса
@@ -0,0 +1,158 @@
+import sqlite3
+import time
+import pandas as pd
+from typing import Iterable, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS addresses (
+    address TEXT PRIMARY KEY,
+    collected_at INTEGER NOT NULL
+);
+
+-- Одна транзакция может попасть в историю нескольких собранных кошельков
+-- (отправителя и получателя), поэтому уникальна пара (hash, address)
+CREATE TABLE IF NOT EXISTS transactions (
+    hash TEXT NOT NULL,
+    address TEXT NOT NULL REFERENCES addresses(address),
+    timestamp INTEGER,
+    to_address TEXT,
+    value REAL,
+    method INTEGER,
+    UNIQUE (hash, address)
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_address_timestamp ON transactions (address, timestamp);
+CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp);
+
+CREATE TABLE IF NOT EXISTS labels (
+    address TEXT NOT NULL REFERENCES addresses(address),
+    label TEXT NOT NULL,
+    PRIMARY KEY (address, label)
+);
+"""
+
+# Агрегаты по кошельку считаются в SQLite, без загрузки транзакций в память.
+# Стандартное отклонение (несмещенное, как в pandas) - через сумму квадратов
+AGGREGATES_QUERY = """
+SELECT
+    t.address,
+    l.label,
+    COUNT(t.timestamp) AS transaction_count,
+    MIN(t.timestamp) AS first_transaction,
+    MAX(t.timestamp) AS last_transaction,
+    AVG(t.value) AS mean_value,
+    SUM(t.value) AS total_value,
+    CASE WHEN COUNT(t.value) > 1 THEN
+        (SUM(t.value * t.value) - SUM(t.value) * SUM(t.value) / COUNT(t.value)) / (COUNT(t.value) - 1)
+    END AS value_var,
+    MIN(t.value) AS min_value,
+    MAX(t.value) AS max_value,
+    COUNT(DISTINCT t.method) AS unique_methods,
+    COUNT(DISTINCT t.to_address) AS unique_contracts
+FROM transactions t
+LEFT JOIN labels l ON l.address = t.address
+WHERE t.timestamp IS NOT NULL {where}
+GROUP BY t.address, l.label
+"""
+
+TRANSACTION_COLUMNS = ['hash', 'address', 'timestamp', 'to', 'value', 'method']
+
+
+class TransactionStore:
+    """
+    Локальное хранилище собранных транзакций на SQLite
+
+    Транзакции дедуплицируются между запусками сбора, запросы по адресу
+    и времени идут по индексам, а агрегаты по кошелькам считаются в SQL.
+    """
+
+    def __init__(self, path: str = 'transactions.db', batch_size: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def insert_frame(self, df: pd.DataFrame) -> int:
+        """
+        Добавляет транзакции из DataFrame (колонки hash, address, timestamp, to, value, method
+        и необязательно label) пачками в одной транзакции. Возвращает число новых строк.
+        """
+        if df.empty:
+            return 0
+
+        now = int(time.time())
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO addresses (address, collected_at) VALUES (?, ?)',
+                ((address, now) for address in df['address'].unique())
+            )
+            if 'label' in df.columns:
+                labels = df[['address', 'label']].drop_duplicates()
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO labels (address, label) VALUES (?, ?)',
+                    labels.itertuples(index=False, name=None)
+                )
+            added = self.conn.total_changes - before
+
+            rows = df[TRANSACTION_COLUMNS].astype(object).where(df[TRANSACTION_COLUMNS].notna(), None)
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows.iloc[start:start + self.batch_size]
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO transactions (hash, address, timestamp, to_address, value, method) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    batch.itertuples(index=False, name=None)
+                )
+        return self.conn.total_changes - before - added
+
+    def has_address(self, address: str) -> bool:
+        row = self.conn.execute('SELECT 1 FROM addresses WHERE address = ?', (address,)).fetchone()
+        return row is not None
+
+    def transactions(self, address: str, start: Optional[int] = None, end: Optional[int] = None) -> pd.DataFrame:
+        """Транзакции одного кошелька, опционально в интервале времени"""
+        query = ('SELECT hash, address, timestamp, to_address AS "to", value, method '
+                 'FROM transactions WHERE address = ?')
+        params = [address]
+        if start is not None:
+            query += ' AND timestamp >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND timestamp < ?'
+            params.append(end)
+        return pd.read_sql_query(query + ' ORDER BY timestamp', self.conn, params=params)
+
+    def wallet_aggregates(self, addresses: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Агрегаты по кошелькам (по строке на пару адрес-метка), посчитанные в SQLite
+
+        Колонки совпадают с результатом группировки в train_classifier.load_data;
+        время - unix-время в секундах.
+        """
+        where, params = '', []
+        if addresses is not None:
+            addresses = list(addresses)
+            where = f"AND t.address IN ({', '.join('?' * len(addresses))})"
+            params = addresses
+
+        df = pd.read_sql_query(AGGREGATES_QUERY.format(where=where), self.conn, params=params)
+        df.insert(df.columns.get_loc('value_var'), 'value_std', df['value_var'].clip(lower=0) ** 0.5)
+        return df.drop(columns='value_var')
+
+    def method_counts(self) -> pd.DataFrame:
+        """Число транзакций каждого метода по кошелькам (address, method, count)"""
+        return pd.read_sql_query(
+            'SELECT address, method, COUNT(*) AS count FROM transactions '
+            'GROUP BY address, method ORDER BY address, count DESC',
+            self.conn
+        )
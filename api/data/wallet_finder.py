@@ -5,109 +5,121 @@ import time
 import os
 import pandas as pd
 from moralis_api import MoralisAPI
+from method_registry import MethodRegistry, METHODS_FILE, TRANSFER
+from transaction_store import TransactionStore
 from web3 import Web3
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class WalletFinder:
-    def __init__(self):
+    def __init__(self, store: TransactionStore = None):
         self.moralis = MoralisAPI()
+        self.methods = MethodRegistry.load(METHODS_FILE)
+        self.store = store
         self.etherscan_api_key = os.getenv('ETHERSCAN_API_KEY')
         self.opensea_api_key = os.getenv('OPENSEA_API_KEY')
         self.etherscan_base_url = "https://api.etherscan.io/api"
         self.opensea_base_url = "https://api.opensea.io/api/v1"
         
-    def find_drop_hunters(self, limit: int = 50) -> List[Dict]:
+    def find_drop_hunters(self, limit: int = 50) -> pd.DataFrame:
         """
         Поиск адресов дропхантеров и их транзакций
         """
         testnet_addresses = self._get_active_testnet_addresses(limit)
         
-        transactions_data = []
+        pages = []
+        collected = 0
         for address in testnet_addresses:
             if self._is_drop_hunter(address):
                 txs = self.moralis.get_all_transactions(address)
-                for tx in txs:
-                    transactions_data.append({
-                        'address': address,
-                        'label': 'drop_hunter',
-                        'timestamp': int(tx.get('block_timestamp', 0)),
-                        'to': tx.get('to_address', ''),
-                        'value': float(tx.get('value', 0)) / 1e18,  # Конвертируем из wei в ETH
-                        'method': tx.get('input', '')[:10] if tx.get('input') else 'transfer'
-                    })
-                if len(transactions_data) >= limit * 10:  # Примерно 10 транзакций на адрес
+                page = self._transactions_frame(address, 'drop_hunter', txs)
+                page['method'] = self.methods.encode_selectors(page['input'])
+                page = page.drop(columns='input')
+                self._store_page(page)
+                pages.append(page)
+                collected += len(page)
+                if collected >= limit * 10:  # Примерно 10 транзакций на адрес
                     break
             time.sleep(1)
             
-        return transactions_data
+        return self._concat_pages(pages)
 
-    def find_nft_collectors(self, limit: int = 50) -> List[Dict]:
+    def find_nft_collectors(self, limit: int = 50) -> pd.DataFrame:
         """
         Поиск адресов NFT коллекторов и их транзакций
         """
         nft_addresses = self._get_nft_marketplace_addresses(limit)
         
-        transactions_data = []
+        pages = []
+        collected = 0
         for address in nft_addresses:
             if self._is_nft_collector(address):
                 txs = self.moralis.get_all_transactions(address)
-                for tx in txs:
-                    transactions_data.append({
-                        'address': address,
-                        'label': 'nft_collector',
-                        'timestamp': int(tx.get('block_timestamp', 0)),
-                        'to': tx.get('to_address', ''),
-                        'value': float(tx.get('value', 0)) / 1e18,
-                        'method': self._determine_nft_method(tx)
-                    })
-                if len(transactions_data) >= limit * 10:
+                page = self._transactions_frame(address, 'nft_collector', txs)
+                page['method'] = self.methods.encode_nft_methods(page['input'], page['to'], page['value'])
+                page = page.drop(columns='input')
+                self._store_page(page)
+                pages.append(page)
+                collected += len(page)
+                if collected >= limit * 10:
                     break
             time.sleep(1)
             
-        return transactions_data
+        return self._concat_pages(pages)
 
-    def find_regular_users(self, limit: int = 50) -> List[Dict]:
+    def find_regular_users(self, limit: int = 50) -> pd.DataFrame:
         """
         Поиск адресов обычных пользователей и их транзакций
         """
         regular_addresses = self._get_regular_activity_addresses(limit)
         
-        transactions_data = []
+        pages = []
+        collected = 0
         for address in regular_addresses:
             if self._is_regular_user(address):
                 txs = self.moralis.get_all_transactions(address)
-                for tx in txs:
-                    transactions_data.append({
-                        'address': address,
-                        'label': 'regular_user',
-                        'timestamp': int(tx.get('block_timestamp', 0)),
-                        'to': tx.get('to_address', ''),
-                        'value': float(tx.get('value', 0)) / 1e18,
-                        'method': 'transfer'  # Для обычных пользователей чаще всего простые переводы
-                    })
-                if len(transactions_data) >= limit * 10:
+                page = self._transactions_frame(address, 'regular_user', txs)
+                page['method'] = TRANSFER  # Для обычных пользователей чаще всего простые переводы
+                page = page.drop(columns='input')
+                self._store_page(page)
+                pages.append(page)
+                collected += len(page)
+                if collected >= limit * 10:
                     break
             time.sleep(1)
             
-        return transactions_data
+        return self._concat_pages(pages)
 
-    def _determine_nft_method(self, tx: Dict) -> str:
-        """Определяет метод транзакции для NFT операций"""
-        if tx.get('input', '').startswith('0x23b872dd'):  # transferFrom
-            return 'transfer'
-        elif tx.get('input', '').startswith('0xa0712d68'):  # mint
-            return 'mint'
-        elif tx.get('to', '').lower() in ['0x7be8076f4ea4a4ad08075c2508e481d6c946d12b',  # OpenSea
-                                        '0x7f268357a8c2552623316e2562d90e642bb538e5']:  # Wyvern
-            return 'buy' if float(tx.get('value', 0)) > 0 else 'sell'
-        return 'transfer'
+    def _transactions_frame(self, address: str, label: str, txs: List[Dict]) -> pd.DataFrame:
+        """Преобразует страницу транзакций Moralis в DataFrame одной операцией"""
+        raw = pd.DataFrame(txs, columns=['hash', 'block_timestamp', 'to_address', 'value', 'input'])
+        timestamps = pd.to_datetime(raw['block_timestamp'], utc=True, errors='coerce')
+        return pd.DataFrame({
+            'hash': raw['hash'],
+            'address': address,
+            'label': label,
+            'timestamp': (timestamps - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1),
+            'to': raw['to_address'].fillna(''),
+            'value': pd.to_numeric(raw['value'], errors='coerce').fillna(0) / 1e18,  # Конвертируем из wei в ETH
+            'input': raw['input']
+        })
 
-    def save_to_csv(self, data: List[Dict], filename: str = 'synthetic_wallet_data_with_tech.csv'):
-        """Сохраняет данные в CSV файл"""
-        df = pd.DataFrame(data)
-        df.to_csv(filename, index=False)
+    def _store_page(self, page: pd.DataFrame):
+        """Добавляет страницу в локальное хранилище (дубликаты с прошлых запусков пропускаются)"""
+        if self.store is not None:
+            added = self.store.insert_frame(page)
+            print(f"В хранилище добавлено {added} новых транзакций")
+
+    def _concat_pages(self, pages: List[pd.DataFrame]) -> pd.DataFrame:
+        if not pages:
+            return pd.DataFrame(columns=['hash', 'address', 'label', 'timestamp', 'to', 'value', 'method'])
+        return pd.concat(pages, ignore_index=True)
+
+    def save_to_csv(self, data: pd.DataFrame, filename: str = 'synthetic_wallet_data_with_tech.csv'):
+        """Сохраняет данные в CSV файл, а словарь кодов методов - рядом с ним"""
+        data.to_csv(filename, index=False)
+        self.methods.save(METHODS_FILE)
         print(f"Данные сохранены в {filename}")
 
     def _is_drop_hunter(self, address: str) -> bool:
@@ -291,7 +303,8 @@ class WalletFinder:
         return addresses[:limit]
 
 def main():
-    finder = WalletFinder()
+    store = TransactionStore(os.getenv('TRANSACTION_STORE', 'transactions.db'))
+    finder = WalletFinder(store)
     
     # Собираем данные для каждого класса
     print("Сбор данных о дропхантерах...")
@@ -304,11 +317,12 @@ def main():
     regular_user_data = finder.find_regular_users(limit=200)
     
     # Объединяем все данные
-    all_data = drop_hunter_data + nft_collector_data + regular_user_data
+    all_data = pd.concat([drop_hunter_data, nft_collector_data, regular_user_data], ignore_index=True)
     
     # Сохраняем в CSV
     finder.save_to_csv(all_data)
     
+    store.close()
     print("Сбор данных завершен!")
     print(f"Всего собрано {len(all_data)} транзакций")
 
@@ -0,0 +1,114 @@
+"""
+Дедлайн запроса и решение, успеет ли запрос выполнить поиск похожих кошельков
+
+Поиск похожих кошельков (кодирование описания и поиск в Faiss) на порядки
+медленнее классификатора. Если до дедлайна осталось меньше, чем обычно занимает
+поиск, или одновременно выполняется слишком много поисков, запрос отвечает
+результатом классификатора с пометкой degraded.
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+
+# Причины ответа без поиска похожих кошельков
+DEGRADED_DEADLINE = 'deadline'
+DEGRADED_OVERLOAD = 'overload'
+DEGRADED_TIMEOUT = 'timeout'
+
+# Наименьший таймаут ожидания: нулевой таймаут сокета сделал бы его неблокирующим
+MIN_WAIT = 0.001
+
+
+class Deadline:
+    """Момент, к которому запрос должен быть обработан (по monotonic-часам)"""
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000
+
+    @classmethod
+    def from_header(cls, value: Optional[str], default_ms: float = 0) -> Optional['Deadline']:
+        """
+        Дедлайн из заголовка (оставшееся время в миллисекундах) или значение по умолчанию;
+        None, если дедлайн не задан. ValueError, если значение не конечное число
+        """
+        budget_ms = float(value) if value else default_ms
+        if not math.isfinite(budget_ms):
+            raise ValueError(f"Deadline must be a finite number of milliseconds: {value}")
+        if not budget_ms > 0:
+            return None
+        return cls(budget_ms)
+
+    def remaining(self) -> float:
+        """Оставшееся время в секундах (может быть отрицательным)"""
+        return self.expires_at - time.monotonic()
+
+
+class SimilarityGate:
+    """
+    Допуск к поиску похожих кошельков с учетом дедлайна и нагрузки
+
+    Ожидаемая длительность поиска - экспоненциальное скользящее среднее
+    наблюдаемых длительностей, но не меньше budget_ms. Число одновременных
+    поисков ограничено max_concurrent; поиск, от которого запрос перестал ждать
+    по таймауту, продолжает занимать место, пока действительно не завершится.
+    """
+
+    def __init__(self, budget_ms: float = 200, max_concurrent: int = 4,
+                 reserve_ms: float = 10, smoothing: float = 0.2):
+        self.budget = budget_ms / 1000
+        self.max_concurrent = max_concurrent
+        self.reserve = reserve_ms / 1000  # время на ответ после поиска
+        self.smoothing = smoothing
+        self.expected = self.budget
+        self.in_flight = 0
+        self.degraded_counts = {DEGRADED_DEADLINE: 0, DEGRADED_OVERLOAD: 0, DEGRADED_TIMEOUT: 0}
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: Optional[Deadline]) -> Optional[str]:
+        """Занимает место для поиска; возвращает причину отказа или None, если поиск разрешен"""
+        with self._lock:
+            if deadline is not None and deadline.remaining() - self.reserve < self.expected:
+                return self._degrade(DEGRADED_DEADLINE)
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                return self._degrade(DEGRADED_OVERLOAD)
+            self.in_flight += 1
+            return None
+
+    def release(self, duration: Optional[float]):
+        """Освобождает место и учитывает длительность поиска (None - поиск не выполнялся)"""
+        with self._lock:
+            self.in_flight -= 1
+            if duration is not None:
+                observed = (1 - self.smoothing) * self.expected + self.smoothing * duration
+                self.expected = max(self.budget, observed)
+
+    def degrade(self, reason: str):
+        """Учитывает ответ, посчитанный без части данных (похожих кошельков или признаков графа)"""
+        with self._lock:
+            self._degrade(reason)
+
+    def timed_out(self):
+        self.degrade(DEGRADED_TIMEOUT)
+
+    def timeout_for(self, deadline: Optional[Deadline]) -> Optional[float]:
+        """Сколько секунд можно ждать поиск, оставив время на ответ (не меньше MIN_WAIT)"""
+        if deadline is None:
+            return None
+        return max(deadline.remaining() - self.reserve, MIN_WAIT)
+
+    def _degrade(self, reason: str) -> str:
+        self.degraded_counts[reason] += 1
+        return reason
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "expected_ms": self.expected * 1000,
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "degraded": dict(self.degraded_counts)
+            }
@@ -0,0 +1,235 @@
+import hashlib
+import numpy as np
+from dataclasses import dataclass
+from typing import List, Dict, Sequence
+
+# Порядок признаков должен совпадать с build_feature_matrix в train/train_classifier.py
+FEATURE_NAMES = [
+    'transaction_count', 'mean_value', 'total_value', 'value_std',
+    'min_value', 'max_value', 'value_range', 'value_std_norm',
+    'unique_methods', 'transaction_duration', 'avg_transaction_interval',
+    'transaction_intensity', 'address_length', 'address_prefix', 'address_suffix'
+]
+
+# Признаки графа контрагентов (counterparty_index), которые можно добавить к признакам классификатора
+GRAPH_FEATURE_NAMES = [
+    'unique_counterparties', 'mean_counterparty_degree', 'max_counterparty_degree', 'top_neighbour_jaccard'
+]
+
+
+@dataclass
+class TransactionColumns:
+    """Транзакции кошелька в колоночном виде: параллельные массивы одинаковой длины"""
+    timestamps: np.ndarray  # unix-время в секундах, float64 (NaN для битых значений)
+    values: np.ndarray  # сумма транзакции в ETH, float64
+    methods: np.ndarray  # метод транзакции: строка или целочисленный код
+    to: np.ndarray  # адрес получателя
+
+    @classmethod
+    def from_arrays(cls, timestamps: Sequence, values: Sequence,
+                    methods: Sequence, to: Sequence) -> 'TransactionColumns':
+        """Создает колонки из списков/массивов, проверяя их длину"""
+        lengths = {len(timestamps), len(values), len(methods), len(to)}
+        if len(lengths) != 1:
+            raise ValueError("All transaction columns must have the same length")
+
+        methods = np.asarray(methods)
+        if methods.dtype.kind not in 'iu':
+            methods = np.asarray(methods, dtype=object)
+
+        return cls(
+            timestamps=_to_float_array(timestamps),
+            values=_to_float_array(values),
+            methods=methods,
+            to=np.asarray(to, dtype=object)
+        )
+
+    @classmethod
+    def from_records(cls, transactions: List[Dict]) -> 'TransactionColumns':
+        """Преобразует список транзакций-словарей в колонки"""
+        return cls.from_arrays(
+            [tx.get('timestamp') for tx in transactions],
+            [tx.get('value') for tx in transactions],
+            [tx.get('method') for tx in transactions],
+            [tx.get('to') for tx in transactions]
+        )
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def fingerprint(self) -> str:
+        """
+        Хэш содержимого колонок: одинаковый для одного и того же набора транзакций
+        в одном порядке, независимо от формата, в котором они пришли
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.timestamps.tobytes())
+        digest.update(self.values.tobytes())
+        for column in (self.methods, self.to):
+            if column.dtype.kind in 'iu':
+                digest.update(column.astype(np.int64, copy=False).tobytes())
+            else:
+                digest.update('\x1f'.join(map(str, column.tolist())).encode())
+            digest.update(b'\x1e')
+        return digest.hexdigest()
+
+
+def _to_float_array(values: Sequence) -> np.ndarray:
+    """Приводит значения к float64, заменяя None на NaN"""
+    array = np.asarray(values)
+    if array.dtype.kind in 'iuf':
+        return array.astype(np.float64, copy=False)
+    return np.array([np.nan if v is None else v for v in array.tolist()], dtype=np.float64)
+
+
+def count_unique(values: np.ndarray) -> int:
+    """Число уникальных значений без учета пропусков (аналог pandas nunique)"""
+    if values.dtype.kind in 'iu':
+        return len(np.unique(values))
+    return len({v for v in values.tolist() if v is not None and v == v})
+
+
+def summarize_wallets(transactions) -> Dict[str, Dict]:
+    """Метка и число транзакций каждого кошелька из DataFrame транзакций (колонки address и label)"""
+    groups = transactions.groupby('address')
+    labels = groups['label'].first() if 'label' in transactions.columns else None
+    return {
+        address: {
+            'label': labels[address] if labels is not None else "unknown",
+            'transaction_count': int(count)
+        }
+        for address, count in groups.size().items()
+    }
+
+
+def address_features(wallet_address: str) -> List[float]:
+    """Признаки, извлекаемые из самого адреса кошелька"""
+    return [
+        len(wallet_address),
+        int(wallet_address[2:4], 16),  # первые два символа после 0x
+        int(wallet_address[-4:], 16)  # последние четыре символа
+    ]
+
+
+def compute_features(transaction_count: int, mean_value: float, total_value: float,
+                     value_std: float, min_value: float, max_value: float,
+                     unique_methods: int, first_transaction: float,
+                     last_transaction: float, wallet_address: str) -> List[float]:
+    """Собирает вектор признаков из агрегатов по транзакциям кошелька"""
+    transaction_duration = last_transaction - first_transaction
+    if np.isnan(transaction_duration):
+        transaction_duration = 0.0
+    avg_transaction_interval = transaction_duration / transaction_count if transaction_count else 0.0
+
+    value_range = max_value - min_value
+    value_std_norm = value_std / mean_value if abs(mean_value) > 1e-8 else 0.0
+    transaction_intensity = transaction_count / transaction_duration if transaction_duration > 0 else 0.0
+
+    return [
+        transaction_count,
+        mean_value,
+        total_value,
+        value_std,
+        min_value,
+        max_value,
+        value_range,
+        value_std_norm,
+        unique_methods,
+        transaction_duration,
+        avg_transaction_interval,
+        transaction_intensity,
+        *address_features(wallet_address)
+    ]
+
+
+def extract_features(columns: TransactionColumns, wallet_address: str) -> np.ndarray:
+    """Извлекает признаки для классификации напрямую из колонок транзакций"""
+    timestamps = columns.timestamps[~np.isnan(columns.timestamps)]
+    values = columns.values[~np.isnan(columns.values)]
+
+    if len(timestamps) == 0:
+        raise ValueError("No transactions with valid timestamps")
+
+    features = compute_features(
+        transaction_count=len(timestamps),
+        mean_value=values.mean() if len(values) else np.nan,
+        total_value=values.sum(),
+        value_std=values.std(ddof=1) if len(values) > 1 else np.nan,
+        min_value=values.min() if len(values) else np.nan,
+        max_value=values.max() if len(values) else np.nan,
+        unique_methods=count_unique(columns.methods),
+        first_transaction=timestamps.min(),
+        last_transaction=timestamps.max(),
+        wallet_address=wallet_address
+    )
+    return np.array([features], dtype=np.float64)
+
+
+class FeatureAccumulator:
+    """
+    Накопительные агрегаты по транзакциям кошелька
+
+    Позволяет считать признаки по мере поступления страниц транзакций,
+    не храня сами транзакции. Дисперсия объединяется по формуле Чана.
+    """
+
+    def __init__(self, wallet_address: str):
+        self.wallet_address = wallet_address
+        self.transaction_count = 0
+        self.value_count = 0
+        self.value_mean = 0.0
+        self.value_m2 = 0.0  # сумма квадратов отклонений от среднего
+        self.total_value = 0.0
+        self.min_value = np.nan
+        self.max_value = np.nan
+        self.first_transaction = np.nan
+        self.last_transaction = np.nan
+        self.methods = set()
+        self.counterparties = set()  # адреса получателей, для поиска по контрагентам
+
+    def update(self, columns: TransactionColumns):
+        """Добавляет в агрегаты очередную порцию транзакций"""
+        timestamps = columns.timestamps[~np.isnan(columns.timestamps)]
+        values = columns.values[~np.isnan(columns.values)]
+
+        if len(timestamps):
+            self.transaction_count += len(timestamps)
+            self.first_transaction = np.fmin(self.first_transaction, timestamps.min())
+            self.last_transaction = np.fmax(self.last_transaction, timestamps.max())
+
+        if len(values):
+            batch_count = len(values)
+            batch_mean = values.mean()
+            batch_m2 = ((values - batch_mean) ** 2).sum()
+
+            count = self.value_count + batch_count
+            delta = batch_mean - self.value_mean
+            self.value_mean += delta * batch_count / count
+            self.value_m2 += batch_m2 + delta ** 2 * self.value_count * batch_count / count
+            self.value_count = count
+
+            self.total_value += values.sum()
+            self.min_value = np.fmin(self.min_value, values.min())
+            self.max_value = np.fmax(self.max_value, values.max())
+
+        self.methods.update(v for v in columns.methods.tolist() if v is not None and v == v)
+        self.counterparties.update(v for v in columns.to.tolist() if isinstance(v, str) and v)
+
+    def features(self) -> np.ndarray:
+        """Возвращает текущий вектор признаков в том же формате, что и extract_features"""
+        if self.transaction_count == 0:
+            raise ValueError("No transactions with valid timestamps")
+
+        features = compute_features(
+            transaction_count=self.transaction_count,
+            mean_value=self.value_mean if self.value_count else np.nan,
+            total_value=self.total_value,
+            value_std=np.sqrt(self.value_m2 / (self.value_count - 1)) if self.value_count > 1 else np.nan,
+            min_value=self.min_value,
+            max_value=self.max_value,
+            unique_methods=len(self.methods),
+            first_transaction=self.first_transaction,
+            last_transaction=self.last_transaction,
+            wallet_address=self.wallet_address
+        )
+        return np.array([features], dtype=np.float64)
@@ -0,0 +1,14 @@
+"""
+Сериализация в JSON значений numpy
+
+Общая для сервиса похожих кошельков и логирования метрик обучения. numpy
+не импортируется: значения распознаются по методу tolist.
+"""
+from typing import Any
+
+
+def to_json(value: Any):
+    """default для json.dumps: скаляры и массивы numpy приводятся к стандартным типам, остальное - к строке"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
@@ -0,0 +1,240 @@
+"""
+Версионированный реестр моделей с горячей заменой
+
+Структура каталога реестра:
+    models/
+        CURRENT                 # имя активной версии (если нет - берется последняя по имени)
+        2025-05-01/
+            classifier.joblib
+            scaler.joblib
+            data.csv            # необязательно: данные для поиска похожих кошельков
+            wallet_index.faiss  # необязательно: готовый индекс Faiss для data.csv
+            counterparty_index.npz  # необязательно: готовый индекс контрагентов для data.csv
+
+Новая версия загружается в фоне и подменяет активную одной операцией присваивания.
+Запрос берет ссылку на активную версию в начале обработки и дорабатывает на ней,
+даже если в это время загрузилась новая.
+"""
+import os
+import threading
+import time
+import logging
+import traceback
+import joblib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'CURRENT'
+LEGACY_VERSION = 'train'
+LEGACY_CLASSIFIER_PATH = 'train/blockchain_classifier.joblib'
+LEGACY_SCALER_PATH = 'train/scaler.joblib'
+DEFAULT_DATA_PATH = 'data/data.csv'
+
+# Бэкенды поиска похожих кошельков и имена их готовых индексов в каталоге версии
+SIMILARITY_BACKENDS = {
+    'text': 'wallet_index.faiss',  # эмбеддинги текстовых описаний + Faiss
+    'counterparty': 'counterparty_index.npz'  # пересечение контрагентов, MinHash/LSH
+}
+
+
+def create_similarity_engine(backend: str = 'text') -> Any:
+    """Создает движок поиска похожих кошельков; модули импортируются только для выбранного бэкенда"""
+    if backend == 'text':
+        from wallet_similarity import WalletSimilarity
+        return WalletSimilarity()
+    if backend == 'counterparty':
+        from counterparty_index import CounterpartySimilarity
+        return CounterpartySimilarity()
+    raise ValueError(f"Unknown similarity backend: {backend}")
+
+
+@dataclass
+class ModelBundle:
+    """Набор артефактов одной версии, используемых вместе"""
+    version: str
+    classifier: Any
+    scaler: Any
+    similarity_engine: Any
+    load_timings: Dict[str, float] = field(default_factory=dict)  # секунды на загрузку каждого артефакта
+
+
+class ModelRegistry:
+    def __init__(self, root: str = 'models', shared_similarity: Any = None, similarity_enabled: bool = True,
+                 similarity_backend: str = 'text'):
+        """
+        Args:
+            root: каталог реестра версий
+            shared_similarity: внешний поиск похожих кошельков (например, SimilarityClient);
+                если задан, индекс в процессе не строится
+            similarity_enabled: если False, поиск похожих кошельков не загружается
+                (и не импортируются wallet_similarity, faiss и torch)
+            similarity_backend: бэкенд поиска похожих кошельков (см. SIMILARITY_BACKENDS)
+        """
+        if similarity_backend not in SIMILARITY_BACKENDS:
+            raise ValueError(f"Unknown similarity backend: {similarity_backend}")
+        self.root = root
+        self.shared_similarity = shared_similarity
+        self.similarity_enabled = similarity_enabled
+        self.similarity_backend = similarity_backend
+        self.active: Optional[ModelBundle] = None
+        self.loading_version: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.failed_version: Optional[str] = None  # наблюдатель не загружает ее повторно, пока CURRENT не сменится
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+
+    def list_versions(self) -> List[str]:
+        """Версии в реестре, отсортированные по имени"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, 'classifier.joblib'))
+        )
+
+    def resolve_version(self) -> str:
+        """Версия, которая должна быть активной: из CURRENT или последняя по имени"""
+        current_path = os.path.join(self.root, CURRENT_FILE)
+        if os.path.isfile(current_path):
+            with open(current_path) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        versions = self.list_versions()
+        return versions[-1] if versions else LEGACY_VERSION
+
+    def set_current(self, version: str):
+        """Записывает активную версию в CURRENT, чтобы ее подхватили все воркеры"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f'{CURRENT_FILE}.tmp{os.getpid()}')
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILE))
+
+    def load(self, version: Optional[str] = None) -> ModelBundle:
+        """Синхронно загружает версию и делает ее активной"""
+        version = version or self.resolve_version()
+        bundle = self._load_bundle(version, self.active)
+        with self._lock:
+            self.active = bundle
+        logger.info(f"Model version {version} is active")
+        return bundle
+
+    def reload_async(self, version: Optional[str] = None, pin: bool = False) -> str:
+        """
+        Загружает версию в фоновом потоке и подменяет активную по готовности
+
+        При pin версия записывается в CURRENT только после успешной загрузки,
+        чтобы остальные воркеры не переключались на версию, которая не загружается.
+
+        Raises:
+            RuntimeError: если уже идет загрузка другой версии
+            ValueError: если версии нет в реестре
+        """
+        version = version or self.resolve_version()
+        if version != LEGACY_VERSION and version not in self.list_versions():
+            raise ValueError(f"Unknown model version: {version}")
+
+        with self._lock:
+            if self.loading_version is not None:
+                raise RuntimeError(f"Version {self.loading_version} is already loading")
+            self.loading_version = version
+
+        def run():
+            try:
+                self.load(version)
+                if pin:
+                    self.set_current(version)
+                self.last_error = None
+                self.failed_version = None
+            except Exception as e:
+                logger.error(f"Failed to load model version {version}: {str(e)}")
+                logger.error(traceback.format_exc())
+                self.last_error = f"{version}: {e}"
+                self.failed_version = version
+            finally:
+                with self._lock:
+                    self.loading_version = None
+
+        threading.Thread(target=run, name=f"model-reload-{version}", daemon=True).start()
+        return version
+
+    def start_watcher(self, interval: float = 30.0):
+        """
+        Периодически проверяет реестр и загружает новую версию, когда она появляется
+
+        Версия, которая не загрузилась, повторно не загружается, пока CURRENT не укажет
+        на другую версию (или пока ее не перезагрузят явно через reload_async).
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    version = self.resolve_version()
+                    if self.failed_version is not None and version != self.failed_version:
+                        self.failed_version = None
+                    if ((self.active is None or version != self.active.version) and self.loading_version is None
+                            and version != self.failed_version):
+                        logger.info(f"New model version detected: {version}")
+                        self.reload_async(version)
+                except Exception as e:
+                    logger.warning(f"Model watcher error: {str(e)}")
+
+        self._watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def _load_bundle(self, version: str, previous: Optional[ModelBundle]) -> ModelBundle:
+        logger.info(f"Loading model version {version}...")
+        if version == LEGACY_VERSION:
+            version_dir = None
+            classifier_path, scaler_path = LEGACY_CLASSIFIER_PATH, LEGACY_SCALER_PATH
+        else:
+            version_dir = os.path.join(self.root, version)
+            classifier_path = os.path.join(version_dir, 'classifier.joblib')
+            scaler_path = os.path.join(version_dir, 'scaler.joblib')
+
+        load_timings = {}
+        start = time.perf_counter()
+        classifier = joblib.load(classifier_path)
+        load_timings['classifier'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scaler = joblib.load(scaler_path)
+        load_timings['scaler'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        similarity_engine = self._load_similarity(version_dir, previous)
+        load_timings['similarity'] = time.perf_counter() - start
+
+        logger.info(f"Model version {version} load timings: "
+                    + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in load_timings.items()))
+        return ModelBundle(version, classifier, scaler, similarity_engine, load_timings)
+
+    def _load_similarity(self, version_dir: Optional[str], previous: Optional[ModelBundle]) -> Any:
+        if not self.similarity_enabled:
+            return None
+        if self.shared_similarity is not None:
+            # Общий процесс поиска загружает свои данные сам (--data) и не следит за версиями реестра
+            return self.shared_similarity
+
+        data_path = os.path.join(version_dir, 'data.csv') if version_dir else None
+        index_path = os.path.join(version_dir, SIMILARITY_BACKENDS[self.similarity_backend]) if version_dir else None
+        has_data = data_path is not None and os.path.isfile(data_path)
+
+        # Версия без своих данных для поиска переиспользует уже построенный индекс
+        if not has_data and previous is not None:
+            return previous.similarity_engine
+
+        engine = create_similarity_engine(self.similarity_backend)
+        engine.load_data(data_path if has_data else DEFAULT_DATA_PATH)
+        if has_data and os.path.isfile(index_path):
+            engine.load_index(index_path)
+        else:
+            logger.info("Building similarity index...")
+            engine.build_index()
+        return engine
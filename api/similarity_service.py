@@ -0,0 +1,185 @@
+"""
+Отдельный процесс поиска похожих кошельков
+
+Модель SentenceTransformer, данные транзакций и индекс Faiss загружаются
+один раз в этом процессе, а воркеры uvicorn обращаются к нему через Unix-сокет.
+Так память не растет с числом воркеров.
+
+Запуск:
+    python similarity_service.py --socket /tmp/wallet_similarity.sock
+    SIMILARITY_SOCKET=/tmp/wallet_similarity.sock uvicorn app:app --workers 4
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Any, Optional
+from json_utils import to_json
+
+DEFAULT_SOCKET_PATH = '/tmp/wallet_similarity.sock'
+
+
+def _to_list(values) -> Optional[List]:
+    """Уникальные непустые адреса в порядке первой встречи"""
+    return None if values is None else list(dict.fromkeys(v for v in values if isinstance(v, str) and v))
+
+
+class SimilarityClient:
+    """Клиент к процессу поиска похожих кошельков с тем же интерфейсом, что и WalletSimilarity"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 30.0, backend: str = 'text'):
+        """backend должен совпадать с --backend сервиса"""
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.backend = backend
+        # Контрагенты пересылаются сервису, только если его бэкенд их использует
+        self.uses_counterparties = backend == 'counterparty'
+
+    def _call(self, method: str, timeout: Optional[float] = None, **params) -> Any:
+        timeout = self.timeout if timeout is None else timeout
+        if timeout <= 0:
+            # settimeout(0) перевел бы сокет в неблокирующий режим вместо ожидания
+            raise TimeoutError(f"No time left to call the similarity service ({method})")
+        # Сервис не начинает запрос, от которого клиент уже перестал ждать
+        params['timeout'] = timeout
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps({'method': method, 'params': params}).encode() + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+
+        if not line:
+            raise ConnectionError("Similarity service closed the connection")
+        response = json.loads(line)
+        if response.get('timeout'):
+            raise TimeoutError(response['error'])
+        if 'error' in response:
+            raise RuntimeError(f"Similarity service error: {response['error']}")
+        return response['result']
+
+    def find_similar_wallets(self, address: str, k: int = 5, labels: Optional[List[str]] = None,
+                             exclude_labels: Optional[List[str]] = None,
+                             counterparties: Optional[List[str]] = None,
+                             timeout: Optional[float] = None) -> List[Dict]:
+        """
+        Находит k наиболее похожих кошельков
+
+        timeout ограничивает ожидание ответа (по умолчанию - таймаут клиента);
+        по истечении соединение закрывается и выбрасывается TimeoutError, а сервис
+        пропускает запрос, если еще не начал его выполнять.
+        """
+        return self._call('find_similar_wallets', timeout=timeout, address=address, k=k,
+                          labels=labels, exclude_labels=exclude_labels,
+                          counterparties=_to_list(counterparties) if self.uses_counterparties else None)
+
+    def graph_features(self, address: str, counterparties: Optional[List[str]] = None,
+                       timeout: Optional[float] = None) -> np.ndarray:
+        """Признаки графа контрагентов (только для бэкенда counterparty); timeout - как в find_similar_wallets"""
+        return np.array(self._call('graph_features', timeout=timeout, address=address,
+                                   counterparties=_to_list(counterparties)),
+                        dtype=np.float64)
+
+    def ping(self) -> bool:
+        return self._call('ping')
+
+
+class _SimilarityHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            received_at = time.monotonic()
+            try:
+                request = json.loads(line)
+                result = self.server.dispatch(request['method'], request.get('params', {}), received_at)
+                response = {'result': result}
+            except TimeoutError as e:
+                response = {'error': str(e), 'timeout': True}
+            except Exception as e:
+                response = {'error': str(e)}
+            try:
+                self.wfile.write(json.dumps(response, default=to_json).encode() + b'\n')
+            except (BrokenPipeError, ConnectionError):
+                # Клиент не дождался ответа и закрыл соединение
+                return
+
+
+class SimilarityServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, engine):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _SimilarityHandler)
+        self.engine = engine
+        # Модель и индекс не гарантируют потокобезопасность, поэтому запросы выполняются по одному
+        self.lock = threading.Lock()
+        self.expired = 0  # сколько запросов пропущено, потому что клиент перестал ждать
+
+    def _run_locked(self, params: Dict, received_at: float, fn):
+        """
+        Выполняет fn под общей блокировкой, если клиент еще ждет ответа
+
+        Запрос, простоявший в очереди дольше таймаута клиента, не выполняется:
+        клиент уже закрыл соединение, и поиск только задержал бы следующие запросы.
+        """
+        timeout = params.get('timeout')
+        with self.lock:
+            if timeout is not None and time.monotonic() - received_at >= timeout:
+                self.expired += 1
+                raise TimeoutError("Request expired while waiting for the similarity engine")
+            return fn()
+
+    def dispatch(self, method: str, params: Dict, received_at: Optional[float] = None) -> Any:
+        if method == 'ping':
+            return True
+        uses_counterparties = getattr(self.engine, 'uses_counterparties', False)
+        received_at = time.monotonic() if received_at is None else received_at
+        if method == 'find_similar_wallets':
+            kwargs = {}
+            if uses_counterparties and params.get('counterparties') is not None:
+                kwargs['counterparties'] = params['counterparties']
+            return self._run_locked(params, received_at, lambda: self.engine.find_similar_wallets(
+                params['address'],
+                k=int(params.get('k', 5)),
+                labels=params.get('labels'),
+                exclude_labels=params.get('exclude_labels'),
+                **kwargs
+            ))
+        if method == 'graph_features':
+            if not hasattr(self.engine, 'graph_features'):
+                raise ValueError("Similarity backend does not provide graph features")
+            return self._run_locked(params, received_at, lambda: self.engine.graph_features(
+                params['address'], params.get('counterparties')
+            ).tolist())
+        raise ValueError(f"Unknown method: {method}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервис поиска похожих кошельков")
+    parser.add_argument('--socket', default=os.getenv('SIMILARITY_SOCKET', DEFAULT_SOCKET_PATH))
+    parser.add_argument('--data', default='data/data.csv')
+    parser.add_argument('--backend', choices=['text', 'counterparty'], default=os.getenv('SIMILARITY_BACKEND', 'text'))
+    args = parser.parse_args()
+
+    from model_registry import create_similarity_engine
+
+    engine = create_similarity_engine(args.backend)
+    engine.load_data(args.data)
+    print("Построение индекса...")
+    engine.build_index()
+
+    server = SimilarityServer(args.socket, engine)
+    print(f"Similarity service listening on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
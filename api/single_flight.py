@@ -0,0 +1,59 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+
+Если несколько запросов с одним ключом приходят, пока первый еще считается,
+они ждут результата первого, а не запускают вычисление заново. Результат
+не кэшируется: после завершения вычисления следующий запрос считает заново.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.calls = 0  # всего вызовов do
+        self.executions = 0  # сколько раз вычисление действительно запускалось
+        self.max_waiters = 0  # наибольшее число запросов, ждавших одно вычисление
+
+    @property
+    def collapsed(self) -> int:
+        """Число запросов, получивших результат чужого вычисления"""
+        return self.calls - self.executions
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Возвращает результат fn() для ключа, запуская не более одного вычисления одновременно
+
+        Исключение вычисления получают все ожидающие его запросы. Отмена одного
+        запроса (например, клиент закрыл соединение) не отменяет общее вычисление.
+        """
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is None:
+            self.executions += 1
+            future = asyncio.ensure_future(fn())
+            self._in_flight[key] = future
+            self._waiters[key] = 0
+            future.add_done_callback(lambda done: self._done(key, done))
+
+        self._waiters[key] += 1
+        self.max_waiters = max(self.max_waiters, self._waiters[key])
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        self._in_flight.pop(key, None)
+        self._waiters.pop(key, None)
+        # Помечаем исключение полученным, даже если все ожидавшие запросы были отменены
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "in_flight": len(self._in_flight),
+            "max_waiters": self.max_waiters
+        }
@@ -0,0 +1,92 @@
+"""
+Профиль холодного старта сервиса
+
+Импортирует app в отдельном процессе с `python -X importtime` и выводит:
+- самые тяжелые импорты модуля app (по суммарному времени с вложенными),
+- время загрузки каждого артефакта активной версии моделей,
+- общее время старта и пиковую память процесса.
+
+Запуск (переменные окружения передаются в дочерний процесс как есть):
+    python startup_profile.py
+    SIMILARITY_MODE=disabled python startup_profile.py --top 15
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Пакеты, которые стоит грузить только при необходимости
+HEAVY_PACKAGES = {'torch', 'sentence_transformers', 'transformers', 'faiss', 'pandas', 'sklearn',
+                  'scipy', 'pyarrow', 'onnxruntime'}
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+CHILD_CODE = """
+import json, resource, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print('STARTUP_PROFILE ' + json.dumps({
+    'startup_seconds': elapsed,
+    'model_version': app.registry.active.version,
+    'load_timings': app.registry.active.load_timings,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """Разбирает вывод -X importtime в (модуль, собственное время мкс, суммарное мкс, глубина вложенности)"""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профиль холодного старта сервиса")
+    parser.add_argument('--top', type=int, default=20, help="Сколько импортов app показать")
+    args = parser.parse_args()
+
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_CODE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    if process.returncode != 0:
+        print(process.stderr[-4000:])
+        sys.exit(process.returncode)
+
+    report_line = next(line for line in process.stdout.splitlines() if line.startswith('STARTUP_PROFILE '))
+    report = json.loads(report_line[len('STARTUP_PROFILE '):])
+
+    entries = parse_importtime(process.stderr)
+    # Непосредственные импорты app имеют глубину 1 (app - глубина 0)
+    app_imports = sorted((e for e in entries if e[3] == 1), key=lambda e: e[2], reverse=True)
+    total_import_us = sum(e[2] for e in entries if e[3] == 0)
+    loaded = {e[0].split('.')[0] for e in entries}
+
+    print(f"{'module':<40}{'cumulative, ms':>16}{'self, ms':>12}")
+    for module, self_us, cumulative_us, _ in app_imports[:args.top]:
+        print(f"{module:<40}{cumulative_us / 1000:>16.1f}{self_us / 1000:>12.1f}")
+    print(f"\nВсего на импорты: {total_import_us / 1000:.1f} мс")
+
+    heavy = sorted(loaded & HEAVY_PACKAGES)
+    print(f"Загружены тяжелые пакеты: {', '.join(heavy) if heavy else 'нет'}")
+
+    print(f"\nЗагрузка артефактов (версия {report['model_version']}):")
+    for name, seconds in report['load_timings'].items():
+        print(f"  {name:<20}{seconds * 1000:>10.1f} мс")
+
+    print(f"\nСтарт сервиса: {report['startup_seconds']:.2f} с, пиковая память: {report['max_rss_mb']:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
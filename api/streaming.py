@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime
+from typing import List, Dict, Any, AsyncIterator, Optional, Protocol
+from features import TransactionColumns
+
+
+class TransactionSource(Protocol):
+    """Источник транзакций кошелька, отдающий их постранично"""
+
+    def iter_transaction_pages(self, address: str, chain: str = "eth",
+                               max_pages: int = 10) -> AsyncIterator[List[Dict[str, Any]]]:
+        ...
+
+
+class StaticTransactionSource:
+    """Локальный источник с заранее заданными страницами (для тестов и отладки без Moralis)"""
+
+    def __init__(self, pages: Dict[str, List[List[Dict[str, Any]]]]):
+        self.pages = pages
+
+    async def iter_transaction_pages(self, address: str, chain: str = "eth",
+                                     max_pages: int = 10) -> AsyncIterator[List[Dict[str, Any]]]:
+        for page in self.pages.get(address, [])[:max_pages]:
+            yield page
+
+
+def moralis_page_to_columns(transactions: List[Dict[str, Any]]) -> TransactionColumns:
+    """Преобразует страницу транзакций Moralis в колонки (значения переводятся из wei в ETH)"""
+    return TransactionColumns.from_arrays(
+        [_parse_timestamp(tx.get('block_timestamp')) for tx in transactions],
+        [float(tx.get('value') or 0) / 1e18 for tx in transactions],
+        [tx.get('method_label') or 'transfer' for tx in transactions],
+        [tx.get('to_address') or '' for tx in transactions]
+    )
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    """Moralis отдает время блока в ISO 8601; поддерживаем и unix-время"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+async def prefetch_pages(pages: AsyncIterator[List[Dict[str, Any]]],
+                         buffer_size: int = 2) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Загружает страницы в фоне, пока вызывающий код обрабатывает текущую
+
+    При досрочном выходе из цикла фоновая загрузка отменяется, а исходный
+    итератор страниц закрывается (вместе с его HTTP-клиентом).
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+    done = object()
+
+    async def produce():
+        try:
+            async for page in pages:
+                await queue.put(page)
+        except asyncio.CancelledError:
+            # Потребитель больше не читает очередь: признак конца в нее не кладем,
+            # иначе put на заполненной очереди ждал бы вечно
+            raise
+        except BaseException:
+            await queue.put(done)
+            raise
+        await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            page = await queue.get()
+            if page is done:
+                break
+            yield page
+        # Пробрасываем ошибки загрузки
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+        elif not producer.cancelled():
+            # Ошибка загрузки при досрочном выходе уже не нужна, но должна быть получена
+            producer.exception()
+        aclose = getattr(pages, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+
+class ConfidenceTracker:
+    """
+    Отслеживает стабильность предсказания между страницами
+
+    Предсказание считается стабильным, если класс не менялся, а уверенность
+    изменилась не более чем на tolerance на протяжении stable_pages страниц подряд.
+    """
+
+    def __init__(self, stable_pages: int = 3, tolerance: float = 0.02, min_confidence: float = 0.5):
+        self.stable_pages = stable_pages
+        self.tolerance = tolerance
+        self.min_confidence = min_confidence
+        self.prediction = None
+        self.confidence = None
+        self.streak = 0
+
+    def update(self, prediction: str, confidence: float) -> bool:
+        """Учитывает предсказание по очередной странице и возвращает True, если можно остановиться"""
+        if (self.prediction == prediction and self.confidence is not None
+                and abs(confidence - self.confidence) <= self.tolerance):
+            self.streak += 1
+        else:
+            self.streak = 0
+
+        self.prediction = prediction
+        self.confidence = confidence
+        return confidence >= self.min_confidence and self.streak >= self.stable_pages
@@ -0,0 +1,214 @@
+"""
+Логирование метрик обучения без блокировки основного цикла
+
+Метрики, графики и таблицы складываются в очередь и отправляются в бэкенд
+фоновым потоком. Бэкенд инициализируется при первой записи, поэтому импорт
+модуля обучения не требует сессии wandb и доступа к сети.
+
+Бэкенды:
+- wandb - Weights & Biases (wandb.init вызывается лениво в фоновом потоке)
+- jsonl - локальный файл metrics.jsonl, графики в PNG и таблицы в CSV рядом с ним
+- none - метрики не сохраняются
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+# Общие с API модули лежат уровнем выше
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from json_utils import to_json
+
+WANDB_PROJECT = 'blockchain-user-classification'
+DEFAULT_METRICS_DIR = 'runs'
+
+# Виды записей в очереди
+_LOG, _FIGURE, _TABLE, _STOP = 'log', 'figure', 'table', 'stop'
+
+
+def _render_figure(render: Callable, figsize=(10, 6)):
+    """
+    Строит график в фоновом потоке через объектный API matplotlib
+
+    pyplot хранит глобальное состояние и не рассчитан на работу из нескольких потоков,
+    поэтому фигура создается напрямую и передается в render(ax).
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=figsize)
+    render(figure.add_subplot())
+    return figure
+
+
+class WandbBackend:
+    def __init__(self, project: str = WANDB_PROJECT, entity: Optional[str] = None):
+        self.project = project
+        self.entity = entity
+        self._wandb = None
+
+    def _run(self):
+        if self._wandb is None:
+            import wandb
+            wandb.init(project=self.project, entity=self.entity)
+            self._wandb = wandb
+        return self._wandb
+
+    def log(self, metrics: Dict, step: Optional[int]):
+        self._run().log(metrics, step=step)
+
+    def log_figure(self, key: str, figure):
+        wandb = self._run()
+        wandb.log({key: wandb.Image(figure)})
+
+    def log_table(self, key: str, df):
+        wandb = self._run()
+        wandb.log({key: wandb.Table(dataframe=df)})
+
+    def close(self):
+        if self._wandb is not None:
+            self._wandb.finish()
+
+
+class JsonlBackend:
+    """Локальное хранение метрик: runs/<время запуска>/metrics.jsonl, *.png, *.csv"""
+
+    def __init__(self, root: str = DEFAULT_METRICS_DIR, run_name: Optional[str] = None):
+        self.run_dir = os.path.join(root, run_name or datetime.now().strftime('%Y%m%d-%H%M%S'))
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(self.run_dir, exist_ok=True)
+            self._file = open(os.path.join(self.run_dir, 'metrics.jsonl'), 'a')
+        return self._file
+
+    def log(self, metrics: Dict, step: Optional[int]):
+        record = {'time': time.time(), **metrics}
+        if step is not None:
+            record['step'] = step
+        self._open().write(json.dumps(record, default=to_json) + '\n')
+
+    def log_figure(self, key: str, figure):
+        self._open()
+        figure.savefig(os.path.join(self.run_dir, f'{key}.png'))
+
+    def log_table(self, key: str, df):
+        self._open()
+        df.to_csv(os.path.join(self.run_dir, f'{key}.csv'), index=False)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class NullBackend:
+    def log(self, metrics: Dict, step: Optional[int]):
+        pass
+
+    def log_figure(self, key: str, figure):
+        pass
+
+    def log_table(self, key: str, df):
+        pass
+
+    def close(self):
+        pass
+
+
+class MetricsSink:
+    """
+    Буферизованная запись метрик в бэкенд из фонового потока
+
+    log/log_figure/log_table только кладут запись в очередь. Если очередь
+    переполнена, запись отбрасывается (число отброшенных выводится при close),
+    чтобы обучение никогда не ждало бэкенд.
+    """
+
+    def __init__(self, backend, max_queue: int = 10000, flush_interval: float = 1.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _put(self, item):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name='metrics-sink', daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def log(self, metrics: Dict, step: Optional[int] = None):
+        self._put((_LOG, dict(metrics), step))
+
+    def log_figure(self, key: str, render: Callable[[Any], None]):
+        """render(ax) рисует график; вызывается в фоновом потоке, поэтому данные должны быть копией"""
+        self._put((_FIGURE, key, render))
+
+    def log_table(self, key: str, df):
+        self._put((_TABLE, key, df.copy()))
+
+    def _write(self, item):
+        kind = item[0]
+        if kind == _LOG:
+            self.backend.log(item[1], item[2])
+        elif kind == _FIGURE:
+            self.backend.log_figure(item[1], _render_figure(item[2]))
+        elif kind == _TABLE:
+            self.backend.log_table(item[1], item[2])
+
+    def _worker(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item[0] == _STOP:
+                break
+            if item is not None:
+                try:
+                    self._write(item)
+                except Exception as e:
+                    print(f"Ошибка записи метрик ({item[0]}): {str(e)}")
+
+            if hasattr(self.backend, 'flush') and time.monotonic() - last_flush >= self.flush_interval:
+                self.backend.flush()
+                last_flush = time.monotonic()
+
+    def close(self):
+        """Дожидается отправки всех записей из очереди и закрывает бэкенд"""
+        if self._thread is not None:
+            self._queue.put((_STOP,))
+            self._thread.join()
+            self._thread = None
+        if self.dropped:
+            print(f"Отброшено записей метрик из-за переполнения очереди: {self.dropped}")
+        self.backend.close()
+
+
+def create_sink(backend: Optional[str] = None) -> MetricsSink:
+    """Создает sink по имени бэкенда или переменной окружения METRICS_BACKEND (по умолчанию wandb)"""
+    backend = backend or os.getenv('METRICS_BACKEND', 'wandb')
+    if backend == 'wandb':
+        return MetricsSink(WandbBackend(entity=os.getenv('WANDB_ENTITY')))
+    if backend == 'jsonl':
+        return MetricsSink(JsonlBackend(os.getenv('METRICS_DIR', DEFAULT_METRICS_DIR)))
+    if backend == 'none':
+        return MetricsSink(NullBackend())
+    raise ValueError(f"Unknown metrics backend: {backend}")
@@ -1,22 +1,31 @@
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.svm import SVC
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, log_loss
-import wandb
 import os
+import time
+import argparse
+import sys
+import hashlib
+import inspect
+import shutil
 from dotenv import load_dotenv
 from datetime import datetime
-import matplotlib.pyplot as plt
 from sklearn.calibration import CalibratedClassifierCV
 from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import RandomizedSearchCV, HalvingRandomSearchCV
+from scipy.stats import randint, uniform, loguniform
+from joblib import Parallel, delayed
+from metrics_sink import create_sink
 
 load_dotenv()
 
-# Инициализация wandb
-wandb.init(project="blockchain-user-classification", entity=os.getenv('WANDB_ENTITY'))
+# Метрики пишутся в фоне; бэкенд (wandb по умолчанию) инициализируется при первой записи
+metrics = create_sink()
 
 class LossTracker:
     def __init__(self, model_name):
@@ -29,44 +38,68 @@ class LossTracker:
         self.iterations.append(iteration)
         self.train_losses.append(train_loss)
         self.val_losses.append(val_loss)
-        wandb.log({
+        metrics.log({
             f"{self.model_name}_train_loss": train_loss,
             f"{self.model_name}_val_loss": val_loss,
             "iteration": iteration
         })
     
     def plot_losses(self):
-        plt.figure(figsize=(10, 6))
-        plt.plot(self.iterations, self.train_losses, label='Training Loss')
-        plt.plot(self.iterations, self.val_losses, label='Validation Loss')
-        plt.xlabel('Iteration')
-        plt.ylabel('Loss')
-        plt.title(f'{self.model_name} Loss Curves')
-        plt.legend()
-        wandb.log({f"{self.model_name}_loss_curves": wandb.Image(plt)})
-        plt.close()
-
-def load_data():
-    """Загрузка и подготовка данных из CSV файла"""
-    df = pd.read_csv('../data/data.csv')
-
-    # Преобразуем timestamp в datetime
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', errors='coerce')
-
-    # Удалим строки с битым временем
-    df = df.dropna(subset=['timestamp'])
-
-    # Группируем по адресу и метке
-    grouped = df.groupby(['address', 'label']).agg({
-        'timestamp': ['count', 'min', 'max'],
-        'value': ['mean', 'sum', 'std', 'min', 'max'],
-        'method': lambda x: x.nunique()
-    }).reset_index()
-
-    # Переименование колонок
-    grouped.columns = ['address', 'label', 'transaction_count', 'first_transaction', 
-                       'last_transaction', 'mean_value', 'total_value', 'value_std', 
-                       'min_value', 'max_value', 'unique_methods']
+        # График строится в фоновом потоке, поэтому передаем копии списков
+        model_name = self.model_name
+        iterations, train_losses, val_losses = list(self.iterations), list(self.train_losses), list(self.val_losses)
+        
+        def render(ax):
+            ax.plot(iterations, train_losses, label='Training Loss')
+            ax.plot(iterations, val_losses, label='Validation Loss')
+            ax.set_xlabel('Iteration')
+            ax.set_ylabel('Loss')
+            ax.set_title(f'{model_name} Loss Curves')
+            ax.legend()
+        
+        metrics.log_figure(f"{model_name}_loss_curves", render)
+
+DATA_PATH = '../data/data.csv'
+FEATURE_CACHE_DIR = 'feature_cache'
+# Увеличивать при изменении логики признаков, которую не видно в load_data/build_feature_matrix
+FEATURES_VERSION = 1
+
+def load_grouped_from_store(store_path):
+    """Агрегаты по кошелькам из локального хранилища транзакций (считаются в SQLite)"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+    from transaction_store import TransactionStore
+
+    with TransactionStore(store_path) as store:
+        grouped = store.wallet_aggregates().drop(columns='unique_contracts')
+    grouped = grouped.dropna(subset=['label'])
+    grouped['first_transaction'] = pd.to_datetime(grouped['first_transaction'], unit='s')
+    grouped['last_transaction'] = pd.to_datetime(grouped['last_transaction'], unit='s')
+    return grouped
+
+def load_data(data_path=DATA_PATH):
+    """Загрузка и подготовка данных из CSV файла или локального хранилища транзакций (.db)"""
+    if data_path.endswith('.db'):
+        grouped = load_grouped_from_store(data_path)
+    else:
+        df = pd.read_csv(data_path)
+
+        # Преобразуем timestamp в datetime
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', errors='coerce')
+
+        # Удалим строки с битым временем
+        df = df.dropna(subset=['timestamp'])
+
+        # Группируем по адресу и метке
+        grouped = df.groupby(['address', 'label']).agg({
+            'timestamp': ['count', 'min', 'max'],
+            'value': ['mean', 'sum', 'std', 'min', 'max'],
+            'method': lambda x: x.nunique()
+        }).reset_index()
+
+        # Переименование колонок
+        grouped.columns = ['address', 'label', 'transaction_count', 'first_transaction', 
+                           'last_transaction', 'mean_value', 'total_value', 'value_std', 
+                           'min_value', 'max_value', 'unique_methods']
 
     # Временные признаки
     grouped['transaction_duration'] = (grouped['last_transaction'] - grouped['first_transaction']).dt.total_seconds()
@@ -106,27 +139,87 @@ def load_data():
 
     return grouped
 
-def extract_features(row):
-    """Извлечение признаков из строки данных"""
-    features = [
-        row['transaction_count'],
-        row['mean_value'],
-        row['total_value'],
-        row['value_std'],
-        row['min_value'],
-        row['max_value'],
-        row['value_range'],
-        row['value_std_norm'],
-        row['unique_methods'],
-        row['transaction_duration'],
-        row['avg_transaction_interval'],
-        row['transaction_intensity'],
-        # Добавляем признаки из адреса
-        len(row['address']),
-        int(row['address'][2:4], 16),  # первые два символа после 0x
-        int(row['address'][-4:], 16),  # последние два символа
-    ]
-    return features
+def build_feature_matrix(df):
+    """Матрица признаков классификатора для всего датафрейма (порядок - features.FEATURE_NAMES)"""
+    address = df['address']
+    return np.column_stack([
+        df['transaction_count'],
+        df['mean_value'],
+        df['total_value'],
+        df['value_std'],
+        df['min_value'],
+        df['max_value'],
+        df['value_range'],
+        df['value_std_norm'],
+        df['unique_methods'],
+        df['transaction_duration'],
+        df['avg_transaction_interval'],
+        df['transaction_intensity'],
+        address.str.len(),
+        address.str[2:4].map(lambda x: int(x, 16)),
+        address.str[-4:].map(lambda x: int(x, 16)),
+    ]).astype(np.float64)
+
+def feature_cache_key(data_path=DATA_PATH):
+    """Ключ кэша: хэш файла данных, версии и исходного кода построения признаков"""
+    digest = hashlib.sha256()
+    # Для хранилища SQLite учитываем и журнал WAL с еще не перенесенными изменениями
+    for path in (data_path, data_path + '-wal'):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    digest.update(str(FEATURES_VERSION).encode())
+    for func in (load_data, load_grouped_from_store, build_feature_matrix):
+        digest.update(inspect.getsource(func).encode())
+    return digest.hexdigest()[:16]
+
+def _write_frame(df, path):
+    try:
+        df.to_parquet(path + '.parquet', index=False)
+    except ImportError:
+        df.to_pickle(path + '.pkl')
+
+def _read_frame(path):
+    if os.path.exists(path + '.parquet'):
+        return pd.read_parquet(path + '.parquet')
+    return pd.read_pickle(path + '.pkl')
+
+def load_features(data_path=DATA_PATH, use_cache=True):
+    """
+    Возвращает сгруппированные по адресам данные, матрицу признаков X и метки y
+
+    Результат кэшируется в FEATURE_CACHE_DIR по ключу feature_cache_key, поэтому
+    при изменении данных или кода признаков кэш пересобирается автоматически.
+    """
+    cache_path = os.path.join(FEATURE_CACHE_DIR, feature_cache_key(data_path))
+    if use_cache and os.path.exists(os.path.join(cache_path, 'X.npy')):
+        print(f"Признаки загружены из кэша {cache_path}")
+        grouped = _read_frame(os.path.join(cache_path, 'grouped'))
+        X = np.load(os.path.join(cache_path, 'X.npy'))
+        y = pd.Series(np.load(os.path.join(cache_path, 'y.npy')), name='label')
+        return grouped, X, y
+
+    grouped = load_data(data_path)
+    X = build_feature_matrix(grouped)
+    y = grouped['label'].reset_index(drop=True)
+
+    if use_cache:
+        # Пишем во временный каталог и переименовываем, чтобы не оставить кэш недописанным
+        tmp_path = cache_path + f'.tmp{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        _write_frame(grouped, os.path.join(tmp_path, 'grouped'))
+        np.save(os.path.join(tmp_path, 'X.npy'), X)
+        np.save(os.path.join(tmp_path, 'y.npy'), y.to_numpy(dtype=str))
+        try:
+            os.rename(tmp_path, cache_path)
+            print(f"Признаки сохранены в кэш {cache_path}")
+        except OSError:
+            # Кэш уже создан параллельным запуском
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return grouped, X, y
 
 def train_and_evaluate_model(model, X_train, y_train, X_val, y_val, X_test, y_test, model_name):
     """Обучение и оценка модели с отслеживанием лосса"""
@@ -192,7 +285,7 @@ def train_and_evaluate_model(model, X_train, y_train, X_val, y_val, X_test, y_te
     test_loss = log_loss(y_test, test_pred_proba)
     
     # Логирование финальных метрик
-    wandb.log({
+    metrics.log({
         f"{model_name}_final_test_accuracy": test_accuracy,
         f"{model_name}_final_test_loss": test_loss
     })
@@ -202,19 +295,36 @@ def train_and_evaluate_model(model, X_train, y_train, X_val, y_val, X_test, y_te
     
     return model, val_loss, test_loss
 
-def train_model():
-    """Обучение и сравнение моделей"""
-    # Загрузка данных
-    df = load_data()
+def add_graph_features(df, X, data_path=DATA_PATH, index_path='counterparty_index.npz'):
+    """
+    Добавляет к X признаки графа контрагентов (см. features.GRAPH_FEATURE_NAMES)
+
+    Индекс строится по всем транзакциям data_path, каждый кошелек считается без учета
+    самого себя - так же, как в API для кошелька из индекса. Индекс сохраняется в index_path,
+    чтобы положить его в версию реестра вместе с моделью.
+    """
+    if data_path.endswith('.db'):
+        raise ValueError("Graph features are built from the CSV 'to' column; use a CSV data file")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from counterparty_index import CounterpartyIndex
+    
+    index = CounterpartyIndex()
+    index.build(pd.read_csv(data_path, usecols=['address', 'to', 'label']))
+    index.save(index_path)
+    print(f"Индекс контрагентов: {len(index.addresses)} кошельков, {len(index.counterparties)} контрагентов")
+    return np.hstack([X, index.graph_feature_matrix(df['address'])])
+
+def prepare_data(use_cache=True, data_path=DATA_PATH, graph_features=False):
+    """Загрузка данных, извлечение признаков, разбиение на train/val/test и масштабирование"""
+    # Загрузка данных и извлечение признаков (с кэшем)
+    df, X, y = load_features(data_path, use_cache=use_cache)
+    if graph_features:
+        X = add_graph_features(df, X, data_path)
     
     # Проверяем уникальные метки
     unique_labels = df['label'].unique()
     print("Уникальные метки в данных:", unique_labels)
     
-    # Извлечение признаков
-    X = np.array([extract_features(row) for _, row in df.iterrows()])
-    y = df['label']
-    
     # Разделение на train/val/test
     X_train, X_temp, y_train, y_temp = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
     X_val, X_test, y_val, y_test = train_test_split(X_temp, y_temp, test_size=0.5, random_state=42, stratify=y_temp)
@@ -225,6 +335,12 @@ def train_model():
     X_val = scaler.transform(X_val)
     X_test = scaler.transform(X_test)
     
+    return X_train, y_train, X_val, y_val, X_test, y_test, scaler
+
+def train_model(use_cache=True, data_path=DATA_PATH, graph_features=False):
+    """Обучение и сравнение моделей"""
+    X_train, y_train, X_val, y_val, X_test, y_test, scaler = prepare_data(use_cache, data_path, graph_features)
+    
     # Определяем модели для сравнения
     models = {
         "RandomForest": RandomForestClassifier(
@@ -261,26 +377,24 @@ def train_model():
         }
     
     # Создаем график сравнения моделей
-    plt.figure(figsize=(10, 6))
     models_names = list(results.keys())
     val_losses = [results[name]['val_loss'] for name in models_names]
     test_losses = [results[name]['test_loss'] for name in models_names]
     
-    x = np.arange(len(models_names))
-    width = 0.35
-    
-    plt.bar(x - width/2, val_losses, width, label='Validation Loss')
-    plt.bar(x + width/2, test_losses, width, label='Test Loss')
-    
-    plt.xlabel('Models')
-    plt.ylabel('Loss')
-    plt.title('Comparison of Models')
-    plt.xticks(x, models_names)
-    plt.legend()
+    def render(ax):
+        x = np.arange(len(models_names))
+        width = 0.35
+        
+        ax.bar(x - width/2, val_losses, width, label='Validation Loss')
+        ax.bar(x + width/2, test_losses, width, label='Test Loss')
+        
+        ax.set_xlabel('Models')
+        ax.set_ylabel('Loss')
+        ax.set_title('Comparison of Models')
+        ax.set_xticks(x, models_names)
+        ax.legend()
     
-    # Сохраняем график в wandb
-    wandb.log({"model_comparison": wandb.Image(plt)})
-    plt.close()
+    metrics.log_figure("model_comparison", render)
     
     # Сохраняем лучшую модель
     best_model_name = min(results, key=lambda x: results[x]['val_loss'])
@@ -292,6 +406,174 @@ def train_model():
     
     return best_model, scaler
 
+# Пространства гиперпараметров для поиска
+SEARCH_SPACES = {
+    "RandomForest": (
+        RandomForestClassifier(random_state=42, class_weight='balanced'),
+        {
+            'n_estimators': randint(50, 400),
+            'max_depth': [None, 5, 10, 20],
+            'min_samples_split': randint(2, 11),
+            'min_samples_leaf': randint(1, 5),
+            'max_features': ['sqrt', 'log2', None]
+        }
+    ),
+    "GradientBoosting": (
+        GradientBoostingClassifier(random_state=42),
+        {
+            'n_estimators': randint(50, 300),
+            'learning_rate': loguniform(0.01, 0.3),
+            'max_depth': randint(2, 6),
+            'subsample': uniform(0.6, 0.4)
+        }
+    ),
+    "SVM": (
+        SVC(probability=True, random_state=42),
+        {
+            'C': loguniform(0.1, 100),
+            'gamma': ['scale', 'auto'],
+            'kernel': ['rbf', 'poly']
+        }
+    )
+}
+
+def measure_latency(model, X, n_calls=50):
+    """Медианная задержка predict_proba на одном кошельке, мс (как при обслуживании API)"""
+    timings = []
+    for row in X[:n_calls]:
+        start = time.perf_counter()
+        model.predict_proba(row.reshape(1, -1))
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+def _fit_candidate(model_name, params, X_train, y_train):
+    estimator = clone(SEARCH_SPACES[model_name][0]).set_params(**params)
+    return estimator.fit(X_train, y_train)
+
+def search_model(strategy='random', n_iter=20, cv_folds=5, top_k=5, latency_budget_ms=None, n_jobs=-1,
+                 use_cache=True, data_path=DATA_PATH, graph_features=False):
+    """
+    Поиск гиперпараметров со стратифицированной кросс-валидацией
+
+    Матрица признаков строится и масштабируется один раз, кандидаты обучаются
+    параллельно на всех ядрах через joblib (большие массивы передаются воркерам
+    через memmap, а не копируются). Лучшие top_k кандидатов переобучаются на train,
+    для них замеряются лосс на валидации и задержка предсказания. Выбирается
+    кандидат с минимальным лоссом среди укладывающихся в latency_budget_ms.
+    """
+    X_train, y_train, X_val, y_val, X_test, y_test, scaler = prepare_data(use_cache, data_path, graph_features)
+    cv = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=42)
+    
+    results = []
+    for name, (estimator, space) in SEARCH_SPACES.items():
+        print(f"\nSearching {name} ({strategy})...")
+        if strategy == 'halving':
+            search = HalvingRandomSearchCV(
+                estimator, space, n_candidates=n_iter, factor=3, cv=cv,
+                scoring='neg_log_loss', n_jobs=n_jobs, random_state=42, refit=False
+            )
+        else:
+            search = RandomizedSearchCV(
+                estimator, space, n_iter=n_iter, cv=cv,
+                scoring='neg_log_loss', n_jobs=n_jobs, random_state=42, refit=False
+            )
+        search.fit(X_train, y_train)
+        
+        cv_results = pd.DataFrame(search.cv_results_)
+        if strategy == 'halving':
+            # Оцениваем кандидатов по последней итерации, на которой они участвовали
+            cv_results = cv_results.sort_values('iter').groupby(
+                cv_results['params'].astype(str)).tail(1)
+        results.append(pd.DataFrame({
+            'model': name,
+            'params': cv_results['params'],
+            'cv_log_loss': -cv_results['mean_test_score'],
+            'cv_log_loss_std': cv_results['std_test_score'],
+            'fit_time_s': cv_results['mean_fit_time'],
+            'cv_predict_time_s': cv_results['mean_score_time']
+        }))
+    
+    # Кандидаты, на которых лосс не посчитался (например, класс не попал в фолд), отбрасываем
+    ranked = pd.concat(results, ignore_index=True).dropna(subset=['cv_log_loss'])
+    ranked = ranked.sort_values('cv_log_loss').reset_index(drop=True)
+    top = ranked.head(top_k).copy()
+    
+    # Переобучаем лучших кандидатов параллельно, а задержку меряем последовательно
+    models = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_candidate)(row['model'], row['params'], X_train, y_train)
+        for _, row in top.iterrows()
+    )
+    top['val_log_loss'] = [log_loss(y_val, model.predict_proba(X_val)) for model in models]
+    top['latency_ms'] = [measure_latency(model, X_val) for model in models]
+    
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_colwidth', 80)
+    print("\nРезультаты поиска:")
+    print(top.drop(columns='params').to_string())
+    ranked.to_csv('search_results.csv', index=False)
+    metrics.log_table("search_results", top.astype({'params': str}))
+    
+    eligible = top if latency_budget_ms is None else top[top['latency_ms'] <= latency_budget_ms]
+    if eligible.empty:
+        print(f"Ни один кандидат не укладывается в {latency_budget_ms} мс, выбираем самый быстрый")
+        eligible = top.nsmallest(1, 'latency_ms')
+    best_position = top.index.get_loc(eligible['val_log_loss'].idxmin())
+    best_model = models[best_position]
+    best = top.iloc[best_position]
+    
+    test_pred_proba = best_model.predict_proba(X_test)
+    test_accuracy = accuracy_score(y_test, best_model.predict(X_test))
+    test_loss = log_loss(y_test, test_pred_proba)
+    print(f"\nВыбрана модель {best['model']} {best['params']}")
+    print(f"val_log_loss={best['val_log_loss']:.4f}, test_log_loss={test_loss:.4f}, "
+          f"test_accuracy={test_accuracy:.4f}, latency={best['latency_ms']:.3f} мс")
+    metrics.log({
+        "search_best_test_accuracy": test_accuracy,
+        "search_best_test_loss": test_loss,
+        "search_best_latency_ms": best['latency_ms']
+    })
+    
+    import joblib
+    joblib.dump(best_model, 'best_classifier.joblib')
+    joblib.dump(scaler, 'scaler.joblib')
+    
+    return best_model, scaler, top
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обучение классификатора пользователей блокчейна")
+    parser.add_argument('--search', choices=['random', 'halving'], default=None,
+                        help="Поиск гиперпараметров вместо обучения фиксированных конфигураций")
+    parser.add_argument('--n-iter', type=int, default=20, help="Число кандидатов на семейство моделей")
+    parser.add_argument('--cv-folds', type=int, default=5)
+    parser.add_argument('--top-k', type=int, default=5, help="Сколько лучших кандидатов проверять на валидации")
+    parser.add_argument('--latency-budget-ms', type=float, default=None,
+                        help="Максимальная задержка предсказания одного кошелька")
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--no-cache', action='store_true', help="Не использовать кэш признаков")
+    parser.add_argument('--data', default=DATA_PATH,
+                        help="CSV с транзакциями или локальное хранилище транзакций (.db)")
+    parser.add_argument('--graph-features', action='store_true',
+                        help="Добавить признаки графа контрагентов (в API нужен SIMILARITY_BACKEND=counterparty)")
+    parser.add_argument('--metrics', choices=['wandb', 'jsonl', 'none'], default=None,
+                        help="Куда писать метрики (по умолчанию METRICS_BACKEND или wandb)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    train_model()
-    wandb.finish() 
\ No newline at end of file
+    args = parse_args()
+    if args.metrics:
+        metrics = create_sink(args.metrics)
+    if args.search:
+        search_model(
+            strategy=args.search,
+            n_iter=args.n_iter,
+            cv_folds=args.cv_folds,
+            top_k=args.top_k,
+            latency_budget_ms=args.latency_budget_ms,
+            n_jobs=args.n_jobs,
+            use_cache=not args.no_cache,
+            data_path=args.data,
+            graph_features=args.graph_features
+        )
+    else:
+        train_model(use_cache=not args.no_cache, data_path=args.data, graph_features=args.graph_features)
+    metrics.close() 
\ No newline at end of file
@@ -1,21 +1,172 @@
 import pandas as pd
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+import os
+from typing import List, Dict, Optional
 import json
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from features import summarize_wallets
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+
+class SentenceEncoder:
+    """
+    Кодировщик описаний кошельков в эмбеддинги
+
+    Кодирует батчами заданного размера и кэширует эмбеддинги уже встречавшихся
+    описаний (LRU). Бэкенды:
+    - torch: стандартная модель SentenceTransformer
+    - onnx: модель, экспортированная в ONNX (по умолчанию квантованная в int8),
+      выполняется через ONNX Runtime и не требует torch
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, backend: str = 'torch',
+                 batch_size: int = 64, num_threads: Optional[int] = None,
+                 onnx_path: Optional[str] = None, cache_size: int = 10000):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        if backend == 'torch':
+            import torch
+            from sentence_transformers import SentenceTransformer
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            self.model = SentenceTransformer(model_name, device='cpu')
+        elif backend == 'onnx':
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+            if onnx_path is None:
+                raise ValueError("onnx_path is required for the onnx backend")
+            options = ort.SessionOptions()
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+            self.input_names = {i.name for i in self.session.get_inputs()}
+            self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(os.path.abspath(onnx_path)))
+        else:
+            raise ValueError(f"Unknown encoder backend: {backend}")
+
+    @classmethod
+    def from_env(cls, model_name: str = DEFAULT_MODEL_NAME) -> 'SentenceEncoder':
+        """Создает кодировщик по переменным окружения EMBEDDING_*"""
+        num_threads = os.getenv('EMBEDDING_THREADS')
+        return cls(
+            model_name=model_name,
+            backend=os.getenv('EMBEDDING_BACKEND', 'torch'),
+            batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', 64)),
+            num_threads=int(num_threads) if num_threads else None,
+            onnx_path=os.getenv('EMBEDDING_ONNX_PATH'),
+            cache_size=int(os.getenv('EMBEDDING_CACHE_SIZE', 10000))
+        )
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Возвращает эмбеддинги (float32, по строке на текст), используя кэш"""
+        missing = list(dict.fromkeys(t for t in texts if t not in self.cache))
+        fresh = dict(zip(missing, self._encode_batches(missing))) if missing else {}
+
+        result = []
+        for text in texts:
+            if text in fresh:
+                result.append(fresh[text])
+            else:
+                self.cache.move_to_end(text)
+                result.append(self.cache[text])
+
+        # Запоминаем только последние cache_size новых эмбеддингов: остальные все равно были бы вытеснены
+        for text in missing[-self.cache_size:] if self.cache_size > 0 else []:
+            self._remember(text, fresh[text])
+        return np.asarray(result, dtype='float32')
+
+    def _remember(self, text: str, embedding: np.ndarray):
+        # Копия строки, а не view: иначе кэш удерживал бы в памяти всю матрицу эмбеддингов батча
+        self.cache[text] = embedding.copy()
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _encode_batches(self, texts: List[str]) -> np.ndarray:
+        if self.backend == 'torch':
+            return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+        batches = [self._encode_onnx(texts[i:i + self.batch_size])
+                   for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(batches)
+
+    def _encode_onnx(self, texts: List[str]) -> np.ndarray:
+        """Mean pooling и L2-нормализация, как в пайплайне all-MiniLM-L6-v2"""
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=256, return_tensors='np')
+        inputs = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+
+def export_onnx(output_dir: str, model_name: str = DEFAULT_MODEL_NAME, quantize: bool = True) -> str:
+    """
+    Экспортирует трансформер модели SentenceTransformer в ONNX
+
+    Рядом с моделью сохраняется токенизатор. При quantize веса дополнительно
+    квантуются в int8 (динамическая квантизация ONNX Runtime).
+    Возвращает путь к итоговому .onnx файлу.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(['пример описания кошелька'], return_tensors='pt')
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample['input_ids'], sample['attention_mask'], sample['token_type_ids']),
+            fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+
+    if not quantize:
+        return fp32_path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = os.path.join(output_dir, 'model_int8.onnx')
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
 
 class WalletSimilarity:
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, encoder: Optional[SentenceEncoder] = None):
+        self.encoder = encoder or SentenceEncoder.from_env(model_name)
         self.index = None
         self.wallet_descriptions = {}
+        self.wallet_summary = {}  # адрес -> метка и число транзакций
         self.wallet_data = None
+        self.label_indexes = {}  # метка -> (индекс Faiss кошельков метки, их позиции в общем индексе)
+        self.method_registry = None  # названия методов по кодам из колонки method
         
     def load_data(self, csv_path: str = 'data/data.csv'):
-        """Загружает данные из CSV и создает описания кошельков"""
+        """Загружает данные из CSV (или локального хранилища .db) и создает описания кошельков"""
+        if csv_path.endswith('.db'):
+            return self.load_store(csv_path)
+        
         print(f"Loading data from {csv_path}")
+        self._load_method_registry(csv_path)
         df = pd.read_csv(csv_path)
         print(f"Loaded {len(df)} transactions")
         print(f"Columns in data: {df.columns.tolist()}")
@@ -40,8 +191,54 @@ class WalletSimilarity:
             description = self._create_wallet_description(group)
             self.wallet_descriptions[address] = description
         
+        # Сводка для ответа без повторного сканирования всех транзакций
+        self.wallet_summary.update(summarize_wallets(df))
+        
         print(f"Created descriptions for {len(self.wallet_descriptions)} wallets")
         
+    def load_store(self, db_path: str):
+        """
+        Создает описания кошельков по агрегатам из локального хранилища транзакций
+
+        Агрегаты считаются в SQLite, транзакции целиком в память не загружаются.
+        """
+        from data.transaction_store import TransactionStore
+        
+        print(f"Loading wallet aggregates from {db_path}")
+        self._load_method_registry(db_path)
+        with TransactionStore(db_path) as store:
+            aggregates = store.wallet_aggregates().drop_duplicates('address')
+            method_counts = store.method_counts()
+        
+        methods_by_address = {
+            address: dict(zip(group['method'], group['count']))
+            for address, group in method_counts.groupby('address')
+        }
+        for row in aggregates.itertuples(index=False):
+            self.wallet_descriptions[row.address] = self._format_description(
+                row.transaction_count, row.unique_contracts, row.mean_value,
+                methods_by_address.get(row.address, {})
+            )
+            self.wallet_summary[row.address] = {
+                'label': row.label if isinstance(row.label, str) else "unknown",
+                'transaction_count': int(row.transaction_count)
+            }
+        
+        print(f"Created descriptions for {len(self.wallet_descriptions)} wallets")
+        
+    def _load_method_registry(self, data_path: str):
+        """
+        Загружает словарь кодов методов, сохраненный сбором данных рядом с датасетом
+
+        Колонка method хранит коды, а в описание кошелька для эмбеддинга должны попасть названия.
+        """
+        from data.method_registry import MethodRegistry, METHODS_FILE
+        
+        methods_path = os.path.join(os.path.dirname(os.path.abspath(data_path)), METHODS_FILE)
+        if not os.path.exists(methods_path):
+            print(f"Warning: {methods_path} not found, only base method codes will be named")
+        self.method_registry = MethodRegistry.load(methods_path)
+        
     def _create_wallet_description(self, transactions: pd.DataFrame) -> str:
         """Создает текстовое описание активности кошелька"""
         # Считаем статистику
@@ -50,7 +247,12 @@ class WalletSimilarity:
         avg_value = transactions['value'].mean()
         methods = transactions['method'].value_counts().to_dict()
         
-        # Создаем описание
+        return self._format_description(total_txs, unique_contracts, avg_value, methods)
+        
+    def _format_description(self, total_txs: int, unique_contracts: int, avg_value: float, methods: Dict) -> str:
+        """Форматирует описание кошелька по его статистике"""
+        if self.method_registry is not None:
+            methods = {self.method_registry.name(method): count for method, count in methods.items()}
         description = f"""
         Кошелек совершил {total_txs} транзакций.
         Взаимодействовал с {unique_contracts} уникальными контрактами.
@@ -64,17 +266,67 @@ class WalletSimilarity:
         """Строит индекс Faiss для быстрого поиска похожих кошельков"""
         # Получаем эмбеддинги для всех описаний
         descriptions = list(self.wallet_descriptions.values())
-        embeddings = self.model.encode(descriptions)
+        embeddings = self.encoder.encode(descriptions)
         
         # Создаем и обучаем индекс
         dimension = embeddings.shape[1]
         self.index = faiss.IndexFlatL2(dimension)
         self.index.add(embeddings.astype('float32'))
+        self._build_label_indexes(embeddings.astype('float32'))
+        
+    def _build_label_indexes(self, embeddings: np.ndarray):
+        """Строит отдельный индекс для каждой метки, чтобы фильтрованный поиск не просматривал лишние кошельки"""
+        labels = np.array([
+            self.wallet_summary.get(address, {}).get('label', "unknown")
+            for address in self.wallet_descriptions
+        ], dtype=object)
+        
+        self.label_indexes = {}
+        for label in np.unique(labels):
+            positions = np.flatnonzero(labels == label)
+            index = faiss.IndexFlatL2(embeddings.shape[1])
+            index.add(embeddings[positions])
+            self.label_indexes[label] = (index, positions)
+        
+    def _search(self, query_embedding: np.ndarray, k: int, labels: Optional[List[str]]):
+        """Поиск k ближайших по всему индексу или только среди кошельков с заданными метками"""
+        if labels is None:
+            distances, indices = self.index.search(query_embedding, k)
+            return distances[0], indices[0]
+        
+        # Ищем в индексах нужных меток и объединяем результаты по расстоянию
+        all_distances, all_indices = [], []
+        for label in labels:
+            if label not in self.label_indexes:
+                continue
+            index, positions = self.label_indexes[label]
+            distances, indices = index.search(query_embedding, min(k, index.ntotal))
+            found = indices[0] >= 0
+            all_distances.append(distances[0][found])
+            all_indices.append(positions[indices[0][found]])
+        
+        if not all_distances:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype=np.int64)
+        distances = np.concatenate(all_distances)
+        indices = np.concatenate(all_indices)
+        order = np.argsort(distances, kind='stable')[:k]
+        return distances[order], indices[order]
         
-    def find_similar_wallets(self, address: str, k: int = 5) -> List[Dict]:
-        """Находит k наиболее похожих кошельков"""
+    def find_similar_wallets(self, address: str, k: int = 5, labels: Optional[List[str]] = None,
+                             exclude_labels: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Находит k наиболее похожих кошельков
+
+        Args:
+            labels: искать только среди кошельков с этими метками
+            exclude_labels: не учитывать кошельки с этими метками
+        """
         print(f"Searching for {k} most similar wallets")
         
+        if exclude_labels:
+            excluded = set(exclude_labels)
+            labels = [label for label in (labels or self.label_indexes) if label not in excluded]
+        
         # Создаем описание для запрашиваемого кошелька
         description = self._create_wallet_description(pd.DataFrame({
             'to': ['0xfriendwallet000000000000000000000', '0xuniswaprouter000000000000000001'],
@@ -84,38 +336,31 @@ class WalletSimilarity:
         
         # Получаем эмбеддинг для запрашиваемого кошелька
         print("Encoding wallet description...")
-        query_embedding = self.model.encode([description])
+        query_embedding = self.encoder.encode([description])
         
         # Ищем похожие кошельки
         print("Searching in index...")
-        distances, indices = self.index.search(query_embedding.astype('float32'), k)
+        distances, indices = self._search(query_embedding.astype('float32'), k, labels)
         print(f"Found distances: {distances}, indices: {indices}")
         
         # Преобразуем индексы в адреса
         addresses = list(self.wallet_descriptions.keys())
-        similar_addresses = [addresses[i] for i in indices[0]]  # Берем все k ближайших
+        similar_addresses = [addresses[i] for i in indices if i >= 0]  # Берем все k ближайших
         print(f"Similar addresses: {similar_addresses}")
         
         # Собираем информацию о похожих кошельках
         results = []
         for addr in similar_addresses:
-            wallet_data = self.wallet_data[self.wallet_data['address'] == addr]
-            if len(wallet_data) == 0:
+            summary = self.wallet_summary.get(addr)
+            if summary is None:
                 print(f"No data found for address {addr}")
                 continue
-            
-            # Проверяем наличие метки класса
-            if 'label' not in wallet_data.columns:
-                print(f"Warning: No 'label' column found for address {addr}")
-                label = "unknown"
-            else:
-                label = wallet_data['label'].iloc[0]
-                print(f"Found label '{label}' for address {addr}")
+            print(f"Found label '{summary['label']}' for address {addr}")
             
             results.append({
                 'address': addr,
-                'label': label,
-                'transaction_count': len(wallet_data),
+                'label': summary['label'],
+                'transaction_count': summary['transaction_count'],
                 'description': self.wallet_descriptions[addr]
             })
         
@@ -128,8 +373,9 @@ class WalletSimilarity:
             faiss.write_index(self.index, path)
             
     def load_index(self, path: str = 'wallet_index.faiss'):
-        """Загружает индекс Faiss"""
+        """Загружает индекс Faiss (описания кошельков должны быть уже загружены через load_data)"""
         self.index = faiss.read_index(path)
+        self._build_label_indexes(self.index.reconstruct_n(0, self.index.ntotal))
 
 def main():
     # Инициализируем поисковик
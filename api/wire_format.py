@@ -0,0 +1,119 @@
+import json
+from typing import List, Dict, Tuple
+from pydantic import BaseModel, ValidationError
+from features import TransactionColumns
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/msgpack'
+CONTENT_TYPE_ARROW = 'application/vnd.apache.arrow.stream'
+
+MSGPACK_CONTENT_TYPES = {CONTENT_TYPE_MSGPACK, 'application/x-msgpack'}
+
+# Ключ метаданных схемы Arrow, в котором передается адрес кошелька
+ARROW_ADDRESS_KEY = b'address'
+
+
+class UnsupportedWireFormat(ValueError):
+    """Формат тела запроса не поддерживается или для него не установлена библиотека"""
+
+
+class WalletRequest(BaseModel):
+    """Построчный формат: одна запись на транзакцию"""
+    address: str
+    transactions: List[Dict]
+
+
+class TransactionColumnsPayload(BaseModel):
+    """Колоночный формат: параллельные массивы одинаковой длины"""
+    timestamp: List[float]
+    value: List[float]
+    method: List[str] | List[int]
+    to: List[str]
+
+
+class ColumnarWalletRequest(BaseModel):
+    address: str
+    columns: TransactionColumnsPayload
+
+
+def decode_wallet_request(body: bytes, content_type: str) -> Tuple[str, TransactionColumns]:
+    """
+    Декодирует тело запроса /analyze в адрес кошелька и колонки транзакций
+
+    Поддерживаются JSON и msgpack (построчный или колоночный формат)
+    и Arrow IPC stream с колонками timestamp, value, method, to.
+    """
+    media_type = (content_type or CONTENT_TYPE_JSON).split(';')[0].strip().lower()
+
+    if media_type == CONTENT_TYPE_ARROW:
+        return _decode_arrow(body)
+
+    if media_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise UnsupportedWireFormat("msgpack is not installed")
+        try:
+            payload = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack body: {e}")
+    elif media_type == CONTENT_TYPE_JSON:
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON body: {e}")
+    else:
+        raise UnsupportedWireFormat(f"Unsupported content type: {media_type}")
+
+    return decode_payload(payload)
+
+
+def decode_payload(payload: Dict) -> Tuple[str, TransactionColumns]:
+    """Разбирает уже десериализованный запрос в построчном или колоночном формате"""
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be an object")
+
+    try:
+        if 'columns' in payload:
+            request = ColumnarWalletRequest.model_validate(payload)
+            columns = request.columns
+            return request.address, TransactionColumns.from_arrays(
+                columns.timestamp, columns.value, columns.method, columns.to
+            )
+
+        request = WalletRequest.model_validate(payload)
+        return request.address, TransactionColumns.from_records(request.transactions)
+    except ValidationError as e:
+        raise ValueError(str(e))
+
+
+def _decode_arrow(body: bytes) -> Tuple[str, TransactionColumns]:
+    """Читает Arrow IPC stream; адрес передается в метаданных схемы"""
+    # pyarrow импортируется только при первом Arrow-запросе, чтобы не замедлять старт сервиса
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise UnsupportedWireFormat("pyarrow is not installed")
+
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Invalid Arrow IPC body: {e}")
+
+    metadata = table.schema.metadata or {}
+    if ARROW_ADDRESS_KEY not in metadata:
+        raise ValueError("Arrow schema metadata must contain 'address'")
+
+    missing_columns = [col for col in ('timestamp', 'value', 'method', 'to') if col not in table.column_names]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+
+    return metadata[ARROW_ADDRESS_KEY].decode(), TransactionColumns.from_arrays(
+        table.column('timestamp').to_numpy(zero_copy_only=False),
+        table.column('value').to_numpy(zero_copy_only=False),
+        table.column('method').to_numpy(zero_copy_only=False),
+        table.column('to').to_numpy(zero_copy_only=False)
+    )